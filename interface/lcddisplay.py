@@ -51,8 +51,10 @@ class LCDDisplay:
         word_width = len(name) * self.font.width
         return round((self._display.width / 2) - (word_width / 2))
 
-    def draw_previous(self, song_name):
+    def draw_previous(self, song_name, late=False):
         name = song_name.split(".")[0].strip()
+        if late:
+            name = "!" + name
         start = self.get_centre_distance(name)
         previous_start = self.get_centre_distance(self.previous)
         # self._display.fill_rectangle(0, 30, 319, 60, self.colours.background_variant)
@@ -64,8 +66,10 @@ class LCDDisplay:
                                 background=self.colours.background_variant)
         self.previous = name
 
-    def draw_current(self, song_name):
+    def draw_current(self, song_name, late=False):
         name = song_name.split(".")[0].strip()
+        if late:
+            name = "!" + name
         start = self.get_centre_distance(name)
         current_start = self.get_centre_distance(self.current)
         # self._display.fill_rectangle(0, 90, 319, 60, self.colours.background)
@@ -77,8 +81,10 @@ class LCDDisplay:
                                 background=self.colours.background)
         self.current = name
 
-    def draw_next(self, song_name):
+    def draw_next(self, song_name, late=False):
         name = song_name.split(".")[0].strip()
+        if late:
+            name = "!" + name
         start = self.get_centre_distance(name)
         next_start = self.get_centre_distance(self.next)
         # self._display.fill_rectangle(0, 150, 319, 60, self.colours.background_variant)
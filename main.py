@@ -15,6 +15,7 @@ from interface.sevensegmentdisplay import LedDisplayTime, LedDisplayBPM
 from pedal.decorators import threadsafe
 from pedal.player import Player
 from pedal.playlist import Playlist
+from pedal.status import PLAYING, TEMPO, TIME, LENGTH, TEMPO_PERCENT
 
 
 class MidiPlayer:
@@ -74,12 +75,18 @@ class MidiPlayer:
         self.screen = LCDDisplay(18, 19, 16, 15, 17, 14, colours=colours)
         self.screen.show_splash("Midi Player v2r17")
 
-        self.playlist = Playlist(path="/storage", playlist_file="playlist.txt")
+        # Songs in late.txt will play late and are marked with "!"
+        self.playlist = Playlist(path="/storage", playlist_file="playlist.txt", late_file="late.txt")
 
         self.player = Player(self.playlist, self)
+        # Medleys: play the rest of the playlist without gaps, see Player.set_list
+        # self.player.set_list = True
+        # self.player.count_in_beats = 4
+        self.shown_song = None
 
         self.current_time = 0
         self.current_tempo = -1
+        self.song_length = 0
 
         # transport/playlist control
         self.is_playing = False
@@ -157,7 +164,11 @@ class MidiPlayer:
 
     def display_time(self, timer=None):
         if self.is_playing:
-            seconds_played = floor(self.current_time / 1000000)
+            current_time = self.current_time
+            if self.song_length:
+                # Song length comes from the tempo map, never show more than that
+                current_time = min(current_time, self.song_length)
+            seconds_played = floor(current_time / 1000000)
             minutes = floor(seconds_played / 60)
             seconds = seconds_played - (60 * minutes)
             current_time_string = "{:>02d}:{:>02d}".format(minutes, seconds)
@@ -172,9 +183,13 @@ class MidiPlayer:
 
     # @threadsafe
     def display_playlist(self, timer=None):
-        self.screen.draw_current(self.playlist.get_current_song())
-        self.screen.draw_previous(self.playlist.get_previous_song())
-        self.screen.draw_next(self.playlist.get_next_song())
+        current_song = self.playlist.get_current_song()
+        previous_song = self.playlist.get_previous_song()
+        next_song = self.playlist.get_next_song()
+        self.shown_song = current_song
+        self.screen.draw_current(current_song, self.playlist.is_late(current_song))
+        self.screen.draw_previous(previous_song, self.playlist.is_late(previous_song))
+        self.screen.draw_next(next_song, self.playlist.is_late(next_song))
         # bpm = self.tempo_to_bpm(self.current_tempo)
         # self.bpm_display.set(bpm)
 
@@ -184,12 +199,16 @@ class MidiPlayer:
             self.go_to_next_song = False
             self.stop()
             self.playlist.goto_next_song()
+            # The player opens the song while the display is drawn
+            self.player.load()
             self.display_playlist()
 
         elif self.go_to_previous_song:
             self.go_to_previous_song = False
             self.stop()
             self.playlist.goto_previous_song()
+            # The player opens the song while the display is drawn
+            self.player.load()
             self.display_playlist()
 
         elif self.start_playing:
@@ -206,6 +225,10 @@ class MidiPlayer:
             self.is_stopped = False
             self.stop()
 
+        elif self.shown_song != self.playlist.get_current_song():
+            # The player went on to the next song in set list mode
+            self.display_playlist()
+
     def tempo_light(self, timer=None):
         if self.is_playing:
             now = ticks_us()
@@ -222,11 +245,18 @@ class MidiPlayer:
         else:
             sleep_ms(500)
 
-    def update_status(self, status):
-        self.current_tempo = status["tempo"]
-        self.current_time = status["time"]
-        self.is_playing = status["playing"]
-        self.is_stopped = not status["playing"]
+    def update_status(self, timer=None):
+        # Poll the status written by the player thread
+        status = self.player.status
+        if status.read():
+            values = status.values
+            # The tempo played, so the BPM display and the tempo light
+            # follow the tempo percent.
+            self.current_tempo = values[TEMPO] * 100 // values[TEMPO_PERCENT]
+            self.current_time = values[TIME]
+            self.song_length = values[LENGTH]
+            self.is_playing = bool(values[PLAYING])
+            self.is_stopped = not values[PLAYING]
 
     def run(self):
         self.rgb_led.set(app.stop_color)
@@ -235,6 +265,7 @@ class MidiPlayer:
         time_display_timer = Timer(period=1000, mode=Timer.PERIODIC, callback=self.display_time)
         tempo_display_timer = Timer(period=1000, mode=Timer.PERIODIC, callback=self.display_tempo)
         transport_timer = Timer(period=500, mode=Timer.PERIODIC, callback=self.handle_transport_controls)
+        status_timer = Timer(period=100, mode=Timer.PERIODIC, callback=self.update_status)
         while True:
             self.tempo_light()
 
@@ -0,0 +1,106 @@
+from pedal import umidiparser
+
+# Time to send a byte at 31250 baud, 10 bits with start and stop bits
+BYTE_US = 320
+
+# UART transmit buffer of the player, see Player.__init__
+TXBUF = 1024
+
+# Lateness that is heard, the notes of a chord on one channel are about
+# 1 ms apart at 31250 baud
+LATENESS_THRESHOLD_US = 5000
+
+
+class UartSimulation:
+    """
+    Simulates sending the events of a song through the UART, to find
+    where the song needs more than the 3125 bytes per second of a
+    31250 baud link.
+
+    Each event is written at its time, and waits in the UART queue
+    until the bytes before it are sent. The lateness of an event is
+    the time its first byte waits. Every window of consecutive events
+    later than threshold_us is recorded in windows, as a tuple
+    (start_us, end_us, max_lateness_us), up to max_windows, window_count
+    has the total.
+
+    If the bytes waiting don't fit in txbuf bytes the write blocks the
+    player thread (or loses bytes, depending on the UART timeout), the
+    number of these overflows is in overflows.
+    """
+
+    def __init__(self, txbuf=TXBUF, threshold_us=LATENESS_THRESHOLD_US, max_windows=16):
+        self.txbuf = txbuf
+        self.threshold_us = threshold_us
+        self.max_windows = max_windows
+        self.max_lateness_us = 0
+        self.overflows = 0
+        self.windows = []
+        self.window_count = 0
+        # Time the UART finishes sending the bytes written
+        self._wire_free_us = 0
+        self._window_start_us = None
+        self._window_end_us = 0
+        self._window_max_us = 0
+
+    def send(self, time_us, length):
+        """
+        Write length bytes at time_us since the start of the song.
+        Times must not decrease.
+        """
+        if self._wire_free_us < time_us:
+            self._wire_free_us = time_us
+        lateness_us = self._wire_free_us - time_us
+        if (lateness_us + BYTE_US - 1) // BYTE_US + length > self.txbuf:
+            self.overflows += 1
+        self._wire_free_us += length * BYTE_US
+
+        if lateness_us > self.max_lateness_us:
+            self.max_lateness_us = lateness_us
+        if lateness_us > self.threshold_us:
+            if self._window_start_us is None:
+                self._window_start_us = time_us
+                self._window_max_us = 0
+            self._window_end_us = time_us
+            if lateness_us > self._window_max_us:
+                self._window_max_us = lateness_us
+        elif self._window_start_us is not None:
+            self._close_window()
+
+    def finish(self):
+        """
+        End of the song, record the last window.
+        """
+        if self._window_start_us is not None:
+            self._close_window()
+
+    def _close_window(self):
+        if len(self.windows) < self.max_windows:
+            self.windows.append((self._window_start_us, self._window_end_us, self._window_max_us))
+        self.window_count += 1
+        self._window_start_us = None
+
+    def is_playable(self):
+        """
+        Returns True if no event is later than threshold_us and the
+        UART buffer never overflows.
+        """
+        return self.window_count == 0 and self.overflows == 0
+
+
+def check_bandwidth(filename, txbuf=TXBUF, threshold_us=LATENESS_THRESHOLD_US, max_windows=16):
+    """
+    Simulate the UART for the MIDI file, using the byte length of each
+    event from MidiEvent.to_midi(). Meta events are not sent.
+    Running status and controller thinning in the player make the
+    real lateness the same or lower.
+    Returns the UartSimulation.
+    """
+    simulation = UartSimulation(txbuf, threshold_us, max_windows)
+    time_us = 0
+    for event in umidiparser.MidiFile(filename, reuse_event_object=True):
+        time_us += event.delta_us
+        if not event.is_meta():
+            simulation.send(time_us, len(event.to_midi()))
+    simulation.finish()
+    return simulation
@@ -0,0 +1,90 @@
+from array import array
+
+from pedal import umidiparser
+
+# Counters, indexes in MidiEncoder._counts
+_SENT = 0
+_SAVED = 1
+
+
+class MidiEncoder:
+    """
+    Encodes MIDI channel events for the UART with running status:
+    the status byte is omitted when it's the same as the status of
+    the previous message. At 31250 baud a byte takes 320 us, so a
+    chord on one channel is sent a third faster.
+
+    With note_off_as_note_on, note off events are sent as note on with
+    velocity 0, which means the same, and share the running status of
+    the note on events. The release velocity is lost.
+    """
+
+    def __init__(self, note_off_as_note_on=False):
+        self.note_off_as_note_on = note_off_as_note_on
+        self.running_status = 0
+        # Bytes sent and saved since start(), in an array updated in place
+        # so that counting doesn't allocate int objects
+        self._counts = array("L", [0, 0])
+
+    @property
+    def bytes_sent(self):
+        """
+        Bytes encoded since start().
+        """
+        return self._counts[_SENT]
+
+    @property
+    def bytes_saved(self):
+        """
+        Status bytes left out by running status since start().
+        """
+        return self._counts[_SAVED]
+
+    def start(self):
+        """
+        Start a song, the first message is sent with its status byte.
+        """
+        self.running_status = 0
+        self._counts[_SENT] = 0
+        self._counts[_SAVED] = 0
+
+    def reset_running_status(self):
+        """
+        The next message is sent with its status byte. Call after sending
+        anything that is not encoded here, such as a sysex event.
+        """
+        self.running_status = 0
+
+    def encode(self, event, buffer, offset):
+        """
+        Write a MIDI channel event to buffer at offset, buffer must have
+        room for 3 bytes after offset.
+        Returns the number of bytes written, 0 for other events.
+        """
+        length = event.to_midi_into(buffer, offset)
+        if not length:
+            return 0
+        return self.encode_in_place(buffer, offset, length)
+
+    def encode_in_place(self, buffer, offset, length):
+        """
+        Encode the MIDI channel message of length bytes, status byte
+        included, that is in buffer at offset.
+        Returns the encoded length.
+        """
+        status = buffer[offset]
+        if self.note_off_as_note_on and status < umidiparser.NOTE_ON:
+            status += umidiparser.NOTE_ON - umidiparser.NOTE_OFF
+            buffer[offset] = status
+            buffer[offset + 2] = 0
+        if status == self.running_status:
+            # Move the data bytes over the status byte
+            buffer[offset] = buffer[offset + 1]
+            if length == 3:
+                buffer[offset + 1] = buffer[offset + 2]
+            length -= 1
+            self._counts[_SAVED] += 1
+        else:
+            self.running_status = status
+        self._counts[_SENT] += length
+        return length
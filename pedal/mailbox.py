@@ -0,0 +1,75 @@
+from array import array
+
+# Player commands, see Player
+NONE = 0
+PLAY = 1    # argument: start position in microseconds
+STOP = 2
+SEEK = 3    # argument: position in microseconds
+LOAD = 4
+TEMPO = 5   # argument: tempo percent
+QUIT = 6
+
+
+class CommandMailbox:
+    """
+    Passes commands from the user interface on core0 to the player
+    worker on core1, without a lock.
+
+    The commands wait in a ring of size entries, each a command and
+    an integer argument. The interface only writes the write index
+    and the worker only writes the read index, an entry is written
+    before the write index moves past it, so neither core waits for
+    the other.
+    """
+
+    def __init__(self, size=8):
+        self._commands = array("B", [NONE] * size)
+        self._arguments = array("L", [0] * size)
+        # Write index, then read index
+        self._indexes = array("L", [0, 0])
+        # Argument of the last command taken
+        self.argument = 0
+
+    def post(self, command, argument=0):
+        """
+        Send a command, called by the interface.
+        Returns False if the mailbox is full and the command is lost.
+        """
+        indexes = self._indexes
+        write = indexes[0]
+        following = (write + 1) % len(self._commands)
+        if following == indexes[1]:
+            return False
+        self._commands[write] = command
+        self._arguments[write] = argument
+        indexes[0] = following
+        return True
+
+    def pending(self):
+        """
+        Returns True if there is a command waiting.
+        """
+        return self._indexes[0] != self._indexes[1]
+
+    def peek(self):
+        """
+        Returns the next command without taking it, NONE if there is none.
+        """
+        read = self._indexes[1]
+        if read == self._indexes[0]:
+            return NONE
+        return self._commands[read]
+
+    def take(self):
+        """
+        Take the next command, called by the worker. Returns the command,
+        NONE if there is none, the argument is left in argument.
+        """
+        indexes = self._indexes
+        read = indexes[1]
+        if read == indexes[0]:
+            return NONE
+        command = self._commands[read]
+        self.argument = self._arguments[read]
+        indexes[1] = (read + 1) % len(self._commands)
+        return command
@@ -2,85 +2,417 @@ import gc
 
 import _thread
 import machine
-from pedal import umidiparser
 import utime
-from pedal.decorators import threadsafe
+from pedal import mailbox
+from pedal import umidiparser
+from pedal.encoder import MidiEncoder
+from pedal.mailbox import CommandMailbox
+from pedal.preload import PreloadedSong
+from pedal.scheduler import Scheduler, MIN_TEMPO_PERCENT, MAX_TEMPO_PERCENT
+from pedal.status import StatusChannel
+
+# Count in clicks, on the General MIDI percussion channel: hi and low wood block
+COUNT_IN_CHANNEL = 9
+COUNT_IN_ACCENT_NOTE = 76
+COUNT_IN_NOTE = 77
+COUNT_IN_VELOCITY = 100
 
 class Player:
     """
     The actual MIDI player
+
+    A single worker thread on core1 plays the songs, started with the
+    first command and running until quit(). The interface sends commands
+    through a mailbox with play(), stop(), seek(), load() and
+    set_tempo_percent(), and polls the status. While playing, the worker
+    checks the mailbox at each event, and every poll_us of the scheduler
+    while waiting for an event, so transport changes take effect within
+    one event.
     """
 
-    def __init__(self, playlist, interface, uart=1):
-        self.thread = None
+    def __init__(self, playlist, interface, uart=1, cache_dir="/cache", note_off_as_note_on=False):
+        # MicroPython's start_new_thread returns None, the flag keeps
+        # a single worker
+        self._started = False
         self.uart = uart
         self.midi_out = machine.UART(self.uart, 31250, txbuf=1024)
 
         self.is_playing = False
         self.utime_played = 0
-        self.tempo_offset = 1
+        self.length_us = 0
         self.playlist = playlist
         self.filename = self.playlist.path + "/" + self.playlist.get_current_song()
         self.player =None;
+        self.events = None
+        # The events are of the current song and none has been played,
+        # so that play() after load() uses them, with the preloaded song
+        self._fresh = False
         self.current_tempo=0
         self.interface = interface
+        # Compiled event caches go to internal flash, the SD card is mounted read only.
+        self.cache_dir = cache_dir
+        # Songs whose cache couldn't be compiled, too long or the flash is full.
+        # They are parsed while playing, compiling again would parse the whole song.
+        self._uncompiled = set()
+
+        # Playback allocates no memory per event, GC pauses on core1 are audible.
+        # The scheduler sends the events at their time through a preallocated buffer.
+        # Running status, and optionally note off as note on velocity 0, saves UART time.
+        self.scheduler = Scheduler(self.midi_out, MidiEncoder(note_off_as_note_on))
+        # The interface polls the status, it's written every status_interval_us of song time,
+        # the displays are updated once a second.
+        self.status = StatusChannel()
+        self.status_interval_us = 100000
+        # Commands for the worker, the worker checks for commands
+        # every idle_poll_us when it isn't playing.
+        self.mailbox = CommandMailbox()
+        self.idle_poll_us = 1000
+        # The next song of the playlist is opened by the player thread
+        # while it waits at least preload_idle_us for an event, or when
+        # it's idle, so that playing it needs no file system access.
+        self.preloaded = None
+        self.preload_idle_us = 50000
+        self._preload_wanted = False
+        # Set list mode, for medleys: at the end of a song the next song of the
+        # playlist starts on the same timeline, after a pause of set_list_pause_us
+        # and count_in_beats clicks at the tempo of the next song.
+        self.set_list = False
+        self.set_list_pause_us = 0
+        self.count_in_beats = 0
         # self.update_status()
 
+    def play(self, start_us=0):
+        """
+        Play the current song of the playlist, from the beginning
+        or from start_us microseconds into the song.
+        Returns False if the command can't be sent, as all commands.
+        """
+        return self._post(mailbox.PLAY, start_us)
+
+    def stop(self):
+        """
+        Stop playing.
+        """
+        return self._post(mailbox.STOP)
+
+    def seek(self, position_us):
+        """
+        Go to position_us microseconds into the current song. Playing
+        continues from there, if stopped the song is loaded to play
+        from there with play(position_us).
+        """
+        return self._post(mailbox.SEEK, position_us)
+
+    def load(self):
+        """
+        Stop playing and open the current song of the playlist, to have it
+        ready when it's played.
+        """
+        return self._post(mailbox.LOAD)
+
+    def set_tempo_percent(self, percent):
+        """
+        Play faster or slower, at percent of the tempo of the song,
+        see Scheduler.set_tempo_percent. Takes effect at the next event
+        if a song is playing, and stays for the next songs.
+        """
+        if not MIN_TEMPO_PERCENT <= percent <= MAX_TEMPO_PERCENT:
+            raise ValueError("tempo percent out of range")
+        return self._post(mailbox.TEMPO, percent)
+
+    def quit(self):
+        """
+        Stop playing and end the worker thread.
+        """
+        return self._post(mailbox.QUIT)
+
+    def _post(self, command, argument=0):
+        posted = self.mailbox.post(command, argument)
+        if not self._started:
+            self._started = True
+            _thread.start_new_thread(self._worker, ())
+        return posted
+
+    def _worker(self):
+        # Serves the mailbox until quit(). An error stops the song and
+        # the worker carries on, otherwise the pedal stays silent
+        # until it is restarted.
+        while True:
+            try:
+                if not self.step():
+                    break
+            except Exception as error:
+                print("Player error:", repr(error))
+                self._recover()
+        _thread.exit()
+
+    def _recover(self):
+        # Stop the notes sounding after an error, if the UART still works
+        try:
+            self.scheduler.panic()
+        except Exception:
+            pass
+        self._stopped()
+
+    def step(self):
+        """
+        Handle the next command, called by the worker thread. Playing a song
+        returns at the end of the song, or when another command arrives.
+        With no command, preload the next song if needed, and sleep
+        idle_poll_us. Returns False after the QUIT command.
+        """
+        command = self.mailbox.take()
+        argument = self.mailbox.argument
+        if command == mailbox.NONE:
+            if self._preload_wanted:
+                self.preload()
+            utime.sleep_us(self.idle_poll_us)
+        elif command == mailbox.PLAY:
+            if argument or not self._is_loaded():
+                self._load(argument)
+            self._run()
+        elif command == mailbox.SEEK:
+            self._load(argument)
+            if self.is_playing:
+                self._run()
+        elif command == mailbox.TEMPO:
+            self.scheduler.set_tempo_percent(argument)
+            self.update_status()
+        elif command == mailbox.LOAD:
+            self._stopped()
+            self._load(0)
+        else:
+            # STOP or QUIT
+            self._stopped()
+        return command != mailbox.QUIT
 
-    @threadsafe
     def update_status(self):
-        status = {"playing": self.is_playing, "tempo": self.current_tempo, "time": self.utime_played}
-        self.interface.update_status(status)
+        # No lock, the player thread must never wait for the interface.
+        self.status.write(self.is_playing, self.current_tempo, self.utime_played, self.length_us,
+                          self.scheduler.tempo_percent)
 
-    def stop(self):
+    def _load(self, start_us):
+        # Open the current song of the playlist, to play from start_us.
+        self.filename = self.playlist.path + "/" + self.playlist.get_current_song()
+        preloaded = self._take_preloaded(self.filename)
+        if preloaded is not None and not start_us:
+            # Opened while the previous song played
+            self.player = preloaded.midi_file
+            self.length_us = preloaded.length_us
+            self.events = preloaded.events()
+        else:
+            if preloaded is not None:
+                preloaded.close()
+            self.events = None
+            self.player = None
+            gc.collect()
+            if self.filename not in self._uncompiled:
+                try:
+                    # Play from the precompiled event cache, compiling it on first use.
+                    self.player = umidiparser.CompiledMidiFile(self.filename, cache_dir=self.cache_dir,
+                                                               reuse_event_object=True)
+                except (OSError, ValueError):
+                    # Cache can't be written, or the song is too long for it
+                    self._uncompiled.add(self.filename)
+            if self.player is None:
+                # Parse the MIDI file while playing
+                self.player = umidiparser.MidiFile(self.filename, cursor_parser=True,
+                                                   reuse_event_object=True)
+            # From the cache header, or from the tempo map of the MIDI file.
+            self.length_us = self.player.length_us()
+            if start_us:
+                # Channel state at the start position is sent first
+                self.events = self.player.seek(start_us)
+            else:
+                self.events = iter(self.player)
+        self._preload_wanted = True
+        self.utime_played = start_us
+        self._fresh = not start_us
+        self.update_status()
+
+    def _is_loaded(self):
+        # True if the current song is loaded to play from the beginning
+        filename = self.playlist.path + "/" + self.playlist.get_current_song()
+        return self._fresh and self.filename == filename
+
+    def _run(self):
+        # Play the song loaded, and the next songs in set list mode,
+        # until the end or until a command other than a tempo change.
+        self.is_playing = True
+        self._fresh = False
+        self.update_status()
+        self.scheduler.start()
+        while self._play_song():
+            song = self._next_song() if self.set_list else None
+            if song is None:
+                self.scheduler.finish()
+                # Notes left on by the song
+                self.scheduler.panic()
+                self.report_output()
+                self._stopped()
+                return
+            if not self._count_in(song.tempo):
+                break
+        # Stopped by a command, stop the notes sounding now
+        self.scheduler.panic()
+
+    def _stopped(self):
         self.is_playing = False
         self.utime_played = 0
         self.current_tempo = 0
+        self.events = None
+        self._fresh = False
         self.update_status()
-        gc.collect()
-
-    def play(self):
-        gc.collect()
-        self.filename = self.playlist.path + "/" + self.playlist.get_current_song()
-        self.player = umidiparser.MidiFile(self.filename)
-        self.utime_played = 0
-        if not self.is_playing:
-            self.is_playing = True
-            self.update_status()
-            self.thread = _thread.start_new_thread(self._play, ())
+        gc.collect()  # pretty sure GC isn't working on core1.
 
-    def _play(self):
-        for event in self.player:
-            if self.is_playing:
-                # delta = round(event.delta_us * self.tempo_offset)
-                self.utime_played += event.delta_us
-                # self.parent.display_time()
-                if event.is_tempo():
-                    self.current_tempo = event.tempo
+    def _play_song(self):
+        # Play the events of the current song.
+        # Returns True at the end of the song, False if there is a command.
+        scheduler = self.scheduler
+        commands = self.mailbox
+        next_status_time = 0
+        for event in self.events:
+            if commands.pending() and self._interrupted():
+                return False
+            delta_us = event.delta_us
+            if delta_us:
+                # Events at the previous time are complete, send them
+                # and update the status while waiting for this event.
+                scheduler.flush()
+                if self.utime_played >= next_status_time:
                     self.update_status()
+                    next_status_time = self.utime_played + self.status_interval_us
+                if self._preload_wanted and delta_us >= self.preload_idle_us:
+                    self.preload()
+                if not self._wait(delta_us):
+                    return False
+                self.utime_played += delta_us
+            # self.parent.display_time()
+            kind = event.kind
+            if kind == umidiparser.KIND_TEMPO:
+                self.current_tempo = event.tempo
+                self.update_status()
 
-                if event.is_end():
-                    self.utime_played = 0
-                    self.is_playing = False
-                    self.update_status()
-                    gc.collect()  # pretty sure GC isn't working on core1.
-                    _thread.exit()
-                    return
+            elif kind == umidiparser.KIND_END:
+                return True
 
-                self.update_status()
-                self.midi_out.write(event.to_midi())
-                utime.sleep_us(event.delta_us)
+            scheduler.send(event)
+        return True
 
-            else:
-                self.utime_played = 0
-                self.is_playing = False
-                self.update_status()
-                gc.collect()
-                # self.midi_out.deinit()
-                _thread.exit()
-                return
+    def _wait(self, delta_us):
+        # Wait delta_us on the scheduler timeline. Returns False if
+        # a command other than a tempo change arrives meanwhile.
+        scheduler = self.scheduler
+        if scheduler.wait(delta_us, self.mailbox):
+            return True
+        while not self._interrupted():
+            if scheduler.sleep(self.mailbox):
+                return True
+        return False
+
+    def _interrupted(self):
+        # Called while playing when there is a command. Tempo changes
+        # are done now, the song stops for other commands, step()
+        # handles them. Returns True if there is another command.
+        commands = self.mailbox
+        while commands.peek() == mailbox.TEMPO:
+            commands.take()
+            self.scheduler.set_tempo_percent(commands.argument)
+        return commands.pending()
+
+    def _next_song(self):
+        # Set list mode: go to the next song of the playlist, that
+        # continues on the same timeline. Returns the PreloadedSong,
+        # None at the end of the playlist or if it can't be opened.
+        if not self.playlist.has_next_song():
+            return None
+        filename = self.playlist.path + "/" + self.playlist.get_next_song()
+        song = self._take_preloaded(filename)
+        if song is None:
+            if filename in self._uncompiled:
+                # Only songs with a compiled cache continue the set list
+                return None
+            # The end of the previous song goes out before compiling
+            self.scheduler.flush()
+            try:
+                song = PreloadedSong(filename, self.cache_dir, compile_cache=True)
+            except (OSError, ValueError):
+                # Cache can't be written, or the song is too long for it
+                self._uncompiled.add(filename)
+                return None
+            finally:
+                # Compiling takes a while, the pause and the count in
+                # start after it instead of being sent at once
+                self.scheduler.rebase()
+        self.playlist.goto_next_song()
+        self.filename = filename
+        self.player = song.midi_file
+        self.length_us = song.length_us
+        self.events = song.events()
+        self._preload_wanted = True
+        self.utime_played = 0
         self.update_status()
-        # print("player._play() - TODO Send the all-notes-off message here.")
-        gc.collect() # pretty sure GC isn't working on core1.
-        _thread.exit()
-        return
+        return song
+
+    def _count_in(self, tempo):
+        # Set list mode: wait set_list_pause_us after the end of the previous song,
+        # then count in at the tempo of the next song.
+        # Returns False if there is a command meanwhile.
+        scheduler = self.scheduler
+        if self.set_list_pause_us and not self._wait(self.set_list_pause_us):
+            return False
+        for beat in range(self.count_in_beats):
+            # Accent on the first beat, the note off goes with the next beat
+            note = COUNT_IN_ACCENT_NOTE if beat == 0 else COUNT_IN_NOTE
+            scheduler.send_message(umidiparser.NOTE_ON | COUNT_IN_CHANNEL, note, COUNT_IN_VELOCITY)
+            waited = self._wait(tempo)
+            scheduler.send_message(umidiparser.NOTE_OFF | COUNT_IN_CHANNEL, note, 0)
+            if not waited:
+                scheduler.flush()
+                return False
+        return True
+
+    def _take_preloaded(self, filename):
+        # Returns the preloaded song if it's filename, None otherwise.
+        preloaded = self.preloaded
+        self.preloaded = None
+        if preloaded is not None and preloaded.filename != filename:
+            preloaded.close()
+            preloaded = None
+        return preloaded
+
+    def preload(self):
+        """
+        Open the next song of the playlist, if its event cache is
+        compiled, see PreloadedSong. Called by the player thread,
+        the file system is used by one core at a time.
+        """
+        self._preload_wanted = False
+        filename = self.playlist.path + "/" + self.playlist.get_next_song()
+        if self.preloaded is not None and self.preloaded.filename == filename:
+            return
+        try:
+            preloaded = PreloadedSong(filename, self.cache_dir)
+        except OSError:
+            # Not compiled yet, or the end of the playlist
+            return
+        if self.preloaded is not None:
+            self.preloaded.close()
+        self.preloaded = preloaded
+
+    def report_output(self):
+        """
+        Print how late the MIDI events were sent during the song,
+        the bytes saved by running status and the controller
+        values thinned because the UART was saturated.
+        """
+        writes, max_us, mean_us, p99_us = self.scheduler.statistics()
+        print("Player lateness: {} writes, max {} us, mean {} us, p99 {} us".format(
+            writes, max_us, mean_us, p99_us))
+        encoder = self.scheduler.encoder
+        print("Player output: {} bytes sent, {} bytes saved by running status".format(
+            encoder.bytes_sent, encoder.bytes_saved))
+        deferred, dropped, note_latency_us, backlog_us = self.scheduler.thinning_statistics()
+        print("Player thinning: {} controller events deferred, {} dropped, "
+              "worst note latency {} us, worst backlog {} us".format(
+              deferred, dropped, note_latency_us, backlog_us))
@@ -7,11 +7,22 @@ class Playlist:
     Manage the playlist
     """
 
-    def __init__(self, path="/storage", playlist_file='playlist.txt'):
-        """ Init the Playlist object."""
+    def __init__(self, path="/storage", playlist_file='playlist.txt', late_file='late.txt'):
+        """
+        Init the Playlist object.
+        late_file lists the songs that need more than the 31250 baud
+        of the MIDI output, one per line, see is_late(). Songs aren't
+        parsed here, the list is made on the host with
+        tools/umidianalyze.py --late-list.
+        """
         sd_contents = os.listdir(path)
         playlist = []
         self.path = path
+        self._late_songs = set()
+        if late_file in sd_contents:
+            with open(self.path + "/" + late_file) as f:
+                for file in f.read().splitlines():
+                    self._late_songs.add(file.strip())
         if playlist_file in sd_contents:
             with open(self.path + "/" + playlist_file) as f:
                 for file in f.read().splitlines():
@@ -36,6 +47,10 @@ class Playlist:
         self._playlist = playlist
         self._current_song_index = 0
 
+    def is_late(self, song):
+        """Return True if the song is in the late_file"""
+        return song in self._late_songs
+
     def goto_next_song(self):
         """Go to the next song in the playlist"""
         if self._current_song_index < (len(self._playlist) - 1):
@@ -58,6 +73,10 @@ class Playlist:
         else:
             return "                              "
 
+    def has_next_song(self):
+        """Return True if the current song is not the last one"""
+        return self._current_song_index < (len(self._playlist) - 1)
+
     def get_next_song(self):
         """Return the next song"""
         if self._current_song_index < (len(self._playlist) - 1):
@@ -0,0 +1,42 @@
+from pedal import umidiparser
+
+
+class PreloadedSong:
+    """
+    A song opened ahead of time, ready to play: the compiled event cache
+    is open, the length is known and the first records have been read,
+    so starting the song needs no file system access.
+
+    Only songs with an up to date compiled cache are preloaded, parsing
+    or compiling a MIDI file takes too long to do while another song
+    plays. OSError is raised otherwise, unless compile_cache is True.
+
+    tempo is the tempo at the start of the song.
+    """
+
+    def __init__(self, filename, cache_dir, compile_cache=False):
+        self.filename = filename
+        self.midi_file = umidiparser.CompiledMidiFile(filename, cache_dir=cache_dir,
+                                                      reuse_event_object=True,
+                                                      compile_cache=compile_cache)
+        self.length_us = self.midi_file.length_us()
+        self._events = iter(self.midi_file)
+        # Opens the cache and reads the first buffer
+        self._first_event = next(self._events)
+        if self._first_event.kind == umidiparser.KIND_TEMPO and not self._first_event.delta_us:
+            self.tempo = self._first_event.tempo
+        else:
+            self.tempo = 500000
+
+    def events(self):
+        """
+        Generator through the events of the song, can be used once.
+        """
+        yield self._first_event
+        yield from self._events
+
+    def close(self):
+        """
+        Close the cache file, if the song is not played.
+        """
+        self._events.close()
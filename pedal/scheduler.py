@@ -0,0 +1,491 @@
+from array import array
+
+import utime
+
+from pedal import umidiparser
+from pedal.encoder import MidiEncoder
+
+# Time to send a byte at 31250 baud, 10 bits with start and stop bits
+BYTE_US = 320
+
+# Continuous controllers, only their latest value matters, so they can be
+# thinned when the UART is saturated: modulation, breath, foot, portamento
+# time, volume, balance, pan, expression, effect controls, general purpose
+# 1 to 4, sound controllers 2 to 10 and effect depths. Bank select, pedals,
+# data entry and channel mode messages are always sent in order.
+_THINNED_CONTROLLERS = (1, 2, 4, 5, 7, 8, 10, 11, 12, 13, 16, 17, 18, 19,
+                        71, 72, 73, 74, 75, 76, 77, 78, 79, 91, 92, 93, 94, 95)
+# Slots per channel, pitch bend is the last one
+_SLOTS = len(_THINNED_CONTROLLERS) + 1
+_PITCHWHEEL_SLOT = len(_THINNED_CONTROLLERS)
+_NO_SLOT = 0xff
+
+# Sustain pedal, all sound off and all notes off controllers, for panic()
+_SUSTAIN = 64
+_ALL_SOUND_OFF = 120
+_ALL_NOTES_OFF = 123
+# Channels with more notes held than this get all notes off and all
+# sound off instead of a note off per note
+PANIC_NOTES_PER_CHANNEL = 3
+
+# Range of the tempo scale, in percent of the tempo of the song
+MIN_TEMPO_PERCENT = 50
+MAX_TEMPO_PERCENT = 200
+# Longest delta time scaled with one multiplication, so that the product
+# by 100 is a small int on MicroPython (30 bits) and doesn't allocate.
+_MAX_SCALED_US = 1 << 23
+
+# Timing values and counters of the scheduler, indexes in Scheduler._values
+_DEADLINE = 0
+_BACKLOG_US = 1
+_MAX_BACKLOG_US = 2
+_MAX_NOTE_LATENCY_US = 3
+_COUNT = 4
+_TOTAL_US = 5
+_MAX_US = 6
+_DEFERRED_EVENTS = 7
+_DROPPED_EVENTS = 8
+_VALUES = 9
+
+
+class Scheduler:
+    """
+    Sends MIDI events to the UART at absolute deadlines.
+
+    Deadlines are counted from the start of the song, adding the
+    delta time of each event to the previous deadline, so the time
+    spent writing to the UART or updating the displays doesn't
+    accumulate as drift. Events with the same deadline are sent
+    with a single UART write, encoded with running status by
+    the encoder, a MidiEncoder.
+
+    The lateness of each write against its deadline is measured,
+    see statistics().
+
+    The time the UART needs to send the bytes written is modelled
+    at BYTE_US per byte. When the bytes waiting to be sent would
+    take more than thin_threshold_us, continuous controllers and pitch
+    bend are deferred, keeping only the latest value per channel and
+    controller, and sent when the UART catches up. Notes are never
+    deferred. thin_threshold_us=None sends everything in order.
+    See thinning_statistics().
+
+    The notes sounding and the sustain pedals are tracked, so that
+    panic() stops only what is sounding when a song is stopped.
+
+    The song can be played faster or slower, see set_tempo_percent().
+    The delta times are scaled by 100/percent with integer math, keeping
+    the remainder for the next one, so the deadlines are exactly the
+    scaled times since the start of the song, without drift.
+    """
+
+    def __init__(self, midi_out, encoder=None, buffer_size=48, bucket_us=100, buckets=100,
+                 thin_threshold_us=10000, poll_us=10000):
+        self.midi_out = midi_out
+        # Longest sleep without checking the command mailbox, see sleep()
+        self.poll_us = poll_us
+        self.encoder = encoder if encoder is not None else MidiEncoder()
+        # Events waiting to be sent, with a view for each length
+        # so that writing doesn't allocate memory.
+        self._buffer = bytearray(buffer_size)
+        view = memoryview(self._buffer)
+        self._views = tuple(view[0:length] for length in range(buffer_size + 1))
+        # Time to send each length at BYTE_US per byte, looked up instead
+        # of multiplied so that the UART model doesn't create int objects
+        self._byte_us = tuple(length * BYTE_US for length in range(buffer_size + 1))
+        self._length = 0
+        self._measure = False
+        # Deadline, UART model and statistics, in an array updated in
+        # place: an int attribute replaced at each event allocates a new
+        # int object on cPython, and on MicroPython above 2**30.
+        self._values = array("l", [0] * _VALUES)
+
+        # Lateness histogram, bucket_us wide buckets, the last bucket
+        # counts everything later than that.
+        self.bucket_us = bucket_us
+        self._histogram = array("L", [0] * buckets)
+
+        # UART model, backlog of bytes written and not sent yet at the
+        # current deadline, in microseconds.
+        self.thin_threshold_us = thin_threshold_us
+
+        # Deferred values, one slot per channel and thinned controller,
+        # and a ring with the slots in the order they were deferred.
+        self._slot_of_controller = bytearray([_NO_SLOT] * 128)
+        for slot, controller in enumerate(_THINNED_CONTROLLERS):
+            self._slot_of_controller[controller] = slot
+        slots = 16 * _SLOTS
+        self._deferred = bytearray(slots)
+        self._deferred_data1 = bytearray(slots)
+        self._deferred_data2 = bytearray(slots)
+        self._ring = array("H", [0] * slots)
+        self._ring_head = 0
+        self._ring_count = 0
+
+        # Notes held, a bit per note, 16 bytes per channel,
+        # and sustain pedal down per channel
+        self._held = bytearray(16 * 16)
+        self._sustain = bytearray(16)
+
+        # Tempo scale, kept from one song to the next
+        self.tempo_percent = 100
+        self._scale_remainder = 0
+
+    def set_tempo_percent(self, percent):
+        """
+        Play at percent of the tempo of the song, from MIN_TEMPO_PERCENT
+        to MAX_TEMPO_PERCENT, 100 is the tempo of the song. Can be called
+        from the other core while playing, the change takes effect at the
+        next delta time.
+        """
+        if not MIN_TEMPO_PERCENT <= percent <= MAX_TEMPO_PERCENT:
+            raise ValueError("tempo percent out of range")
+        self.tempo_percent = percent
+
+    def start(self):
+        """
+        Start a song now, discarding events not sent and the lateness
+        measured for the previous song.
+        """
+        histogram = self._histogram
+        for bucket in range(len(histogram)):
+            histogram[bucket] = 0
+        values = self._values
+        for index in range(_VALUES):
+            values[index] = 0
+        self._length = 0
+        self._measure = False
+        deferred = self._deferred
+        for slot in range(len(deferred)):
+            deferred[slot] = 0
+        self._ring_head = 0
+        self._ring_count = 0
+        self._scale_remainder = 0
+        self._clear_held()
+        self.encoder.start()
+        values[_DEADLINE] = utime.ticks_us()
+
+    def wait(self, delta_us, mailbox=None):
+        """
+        Send the events queued, then sleep until delta_us after
+        the deadline of those events, scaled by the tempo percent.
+        Returns False if woken up by a command, see sleep().
+        """
+        self.flush()
+        if self.tempo_percent != 100:
+            delta_us = self._scale_delta(delta_us)
+        values = self._values
+        values[_DEADLINE] = utime.ticks_add(values[_DEADLINE], delta_us)
+        # The UART sends the backlog meanwhile
+        if values[_BACKLOG_US] > delta_us:
+            values[_BACKLOG_US] -= delta_us
+        else:
+            values[_BACKLOG_US] = 0
+        self._measure = True
+        return self.sleep(mailbox)
+
+    def sleep(self, mailbox=None):
+        """
+        Sleep until the deadline set by wait(). With a CommandMailbox,
+        wake up every poll_us to check it, and return False as soon as
+        there is a command. Returns True at the deadline. After False,
+        sleep() continues waiting for the same deadline.
+        """
+        values = self._values
+        while True:
+            wait_us = utime.ticks_diff(values[_DEADLINE], utime.ticks_us())
+            if wait_us <= 0:
+                return True
+            if mailbox is not None:
+                if mailbox.pending():
+                    return False
+                if wait_us > self.poll_us:
+                    # The clock is read again after sleeping
+                    wait_us = self.poll_us
+                    utime.sleep_us(wait_us)
+                    continue
+            utime.sleep_us(wait_us)
+            return True
+
+    def rebase(self):
+        """
+        Continue the timeline from now if the deadline has passed, after
+        the player was held up, for example compiling the next song in
+        set list mode. The next deadlines are counted from now instead of
+        being sent late all at once until the timeline catches up.
+        """
+        values = self._values
+        late_us = utime.ticks_diff(utime.ticks_us(), values[_DEADLINE])
+        if late_us <= 0:
+            return
+        values[_DEADLINE] = utime.ticks_add(values[_DEADLINE], late_us)
+        # The UART sent the backlog meanwhile
+        if values[_BACKLOG_US] > late_us:
+            values[_BACKLOG_US] -= late_us
+        else:
+            values[_BACKLOG_US] = 0
+
+    def _scale_delta(self, delta_us):
+        # Returns the delta time in wall clock microseconds, the
+        # fraction of microsecond left is added to the next delta time.
+        percent = self.tempo_percent
+        scaled_us = 0
+        while delta_us > _MAX_SCALED_US:
+            delta_us -= _MAX_SCALED_US
+            product = _MAX_SCALED_US * 100 + self._scale_remainder
+            scaled_us += product // percent
+            self._scale_remainder = product % percent
+        product = delta_us * 100 + self._scale_remainder
+        self._scale_remainder = product % percent
+        return scaled_us + product // percent
+
+    def send(self, event):
+        """
+        Queue a MIDI channel event, to be sent together with the
+        other events with the same deadline. Sysex events are sent
+        now. Meta events are not sent.
+        """
+        buffer = self._buffer
+        length = self._length
+        if length + 3 > len(buffer):
+            self.flush()
+            length = 0
+        written = event.to_midi_into(buffer, length)
+        if written:
+            status = buffer[length]
+            if status < umidiparser.POLYTOUCH or (status & 0xf0) == umidiparser.CONTROL_CHANGE:
+                self._hold(status, buffer[length + 1], buffer[length + 2])
+            if self.thin_threshold_us is not None and status >= umidiparser.CONTROL_CHANGE:
+                if self._defer(status, buffer[length + 1], buffer[length + 2]):
+                    return
+            self._length = length + self.encoder.encode_in_place(buffer, length, written)
+            if status < umidiparser.POLYTOUCH:
+                # Note on or off, sent when the backlog and this write are sent
+                values = self._values
+                latency_us = values[_BACKLOG_US] + self._byte_us[self._length]
+                if latency_us > values[_MAX_NOTE_LATENCY_US]:
+                    values[_MAX_NOTE_LATENCY_US] = latency_us
+        elif not event.is_meta():
+            # Sysex, rare enough to allocate.
+            self.flush()
+            data = event.to_midi()
+            self.midi_out.write(data)
+            self._add_backlog(len(data) * BYTE_US)
+            self.encoder.reset_running_status()
+
+    def send_message(self, status, data1, data2=0):
+        """
+        Queue a MIDI channel message made by the player, such as
+        a count in click, with the events of the same deadline.
+        """
+        if self._length + 3 > len(self._buffer):
+            self.flush()
+        buffer = self._buffer
+        length = self._length
+        buffer[length] = status
+        buffer[length + 1] = data1
+        written = 2
+        if status < umidiparser.PROGRAM_CHANGE or status >= umidiparser.PITCHWHEEL:
+            buffer[length + 2] = data2
+            written = 3
+        if status < umidiparser.POLYTOUCH or (status & 0xf0) == umidiparser.CONTROL_CHANGE:
+            self._hold(status, data1, data2)
+        self._length = length + self.encoder.encode_in_place(buffer, length, written)
+
+    def _hold(self, status, data1, data2):
+        # Track the notes held and the sustain pedal, for a note on,
+        # note off or control change.
+        channel = status & 0x0f
+        if status >= umidiparser.CONTROL_CHANGE:
+            if data1 == _SUSTAIN:
+                self._sustain[channel] = data2 >= 64
+            return
+        index = channel * 16 + (data1 >> 3)
+        bit = 1 << (data1 & 7)
+        if status >= umidiparser.NOTE_ON and data2:
+            self._held[index] |= bit
+        else:
+            self._held[index] &= ~bit & 0xff
+
+    def _clear_held(self):
+        held = self._held
+        for index in range(len(held)):
+            held[index] = 0
+        sustain = self._sustain
+        for channel in range(16):
+            sustain[channel] = 0
+
+    def panic(self):
+        """
+        Stop the notes sounding, when a song is stopped. Sends a note off
+        for each note held, with running status, and all notes off and
+        all sound off for channels with more than PANIC_NOTES_PER_CHANNEL
+        notes held. Sustain pedals down are released. Deferred values
+        are discarded. Returns the number of bytes sent, events queued
+        included.
+        """
+        self._measure = False
+        deferred = self._deferred
+        for slot in range(len(deferred)):
+            deferred[slot] = 0
+        self._ring_count = 0
+        bytes_sent = self.encoder.bytes_sent - self._length
+        # The events queued were tracked and encoded with running status,
+        # they must go out before the note offs.
+        self.flush()
+
+        held = self._held
+        for channel in range(16):
+            start = channel * 16
+            count = 0
+            for index in range(start, start + 16):
+                bits = held[index]
+                while bits:
+                    bits &= bits - 1
+                    count += 1
+            if count > PANIC_NOTES_PER_CHANNEL:
+                status = umidiparser.CONTROL_CHANGE | channel
+                self.send_message(status, _ALL_NOTES_OFF, 0)
+                self.send_message(status, _ALL_SOUND_OFF, 0)
+            elif count:
+                status = umidiparser.NOTE_OFF | channel
+                for index in range(start, start + 16):
+                    bits = held[index]
+                    note = (index - start) << 3
+                    while bits:
+                        if bits & 1:
+                            self.send_message(status, note, 0)
+                        bits >>= 1
+                        note += 1
+            if self._sustain[channel]:
+                self.send_message(umidiparser.CONTROL_CHANGE | channel, _SUSTAIN, 0)
+        self._clear_held()
+        self.flush()
+        return self.encoder.bytes_sent - bytes_sent
+
+    def _defer(self, status, data1, data2):
+        # Keep a control change or pitch bend to send it later,
+        # if the UART is saturated or if there is already a deferred
+        # value for the controller. Returns True if deferred.
+        event_type = status & 0xf0
+        if event_type == umidiparser.CONTROL_CHANGE:
+            slot = self._slot_of_controller[data1]
+            if slot == _NO_SLOT:
+                return False
+        elif event_type == umidiparser.PITCHWHEEL:
+            slot = _PITCHWHEEL_SLOT
+        else:
+            return False
+        slot += (status & 0x0f) * _SLOTS
+        if self._deferred[slot]:
+            # Replaces the value not sent yet
+            self._values[_DROPPED_EVENTS] += 1
+        elif self._values[_BACKLOG_US] + self._byte_us[self._length] > self.thin_threshold_us:
+            ring = self._ring
+            ring[(self._ring_head + self._ring_count) % len(ring)] = slot
+            self._ring_count += 1
+            self._deferred[slot] = status
+        else:
+            return False
+        self._deferred_data1[slot] = data1
+        self._deferred_data2[slot] = data2
+        self._values[_DEFERRED_EVENTS] += 1
+        return True
+
+    def _send_deferred(self, threshold_us):
+        # Queue deferred values while they fit in the buffer, and
+        # while the backlog is below threshold_us, if not None.
+        buffer = self._buffer
+        ring = self._ring
+        while self._ring_count and self._length + 3 <= len(buffer):
+            if threshold_us is not None \
+                    and self._values[_BACKLOG_US] + self._byte_us[self._length] >= threshold_us:
+                return
+            slot = ring[self._ring_head]
+            self._ring_head = (self._ring_head + 1) % len(ring)
+            self._ring_count -= 1
+            length = self._length
+            buffer[length] = self._deferred[slot]
+            buffer[length + 1] = self._deferred_data1[slot]
+            buffer[length + 2] = self._deferred_data2[slot]
+            self._deferred[slot] = 0
+            self._length = length + self.encoder.encode_in_place(buffer, length, 3)
+
+    def _add_backlog(self, backlog_us):
+        values = self._values
+        values[_BACKLOG_US] += backlog_us
+        if values[_BACKLOG_US] > values[_MAX_BACKLOG_US]:
+            values[_MAX_BACKLOG_US] = values[_BACKLOG_US]
+
+    def flush(self):
+        """
+        Send the events queued now, and deferred values if the UART
+        is not saturated.
+        """
+        if self._measure:
+            # First write for this deadline
+            self._measure = False
+            values = self._values
+            late_us = utime.ticks_diff(utime.ticks_us(), values[_DEADLINE])
+            if late_us < 0:
+                late_us = 0
+            values[_COUNT] += 1
+            values[_TOTAL_US] += late_us
+            if late_us > values[_MAX_US]:
+                values[_MAX_US] = late_us
+            bucket = late_us // self.bucket_us
+            histogram = self._histogram
+            if bucket >= len(histogram):
+                bucket = len(histogram) - 1
+            histogram[bucket] += 1
+        if self._ring_count:
+            self._send_deferred(self.thin_threshold_us)
+        if self._length:
+            self.midi_out.write(self._views[self._length])
+            self._add_backlog(self._byte_us[self._length])
+            self._length = 0
+
+    def finish(self):
+        """
+        Send the events queued and all deferred values, at the end of the song.
+        """
+        self.flush()
+        while self._ring_count:
+            self._send_deferred(None)
+            self.flush()
+
+    def statistics(self):
+        """
+        Returns the lateness of the writes since start(), as a tuple
+        (writes, maximum, mean, 99th percentile), in microseconds.
+        The 99th percentile is rounded up to the histogram bucket.
+        """
+        values = self._values
+        count = values[_COUNT]
+        if count == 0:
+            return 0, 0, 0, 0
+        histogram = self._histogram
+        threshold = count - count // 100
+        cumulative = 0
+        p99_us = len(histogram) * self.bucket_us
+        for bucket in range(len(histogram)):
+            cumulative += histogram[bucket]
+            if cumulative >= threshold:
+                p99_us = (bucket + 1) * self.bucket_us
+                break
+        if p99_us > values[_MAX_US]:
+            p99_us = values[_MAX_US]
+        return count, values[_MAX_US], values[_TOTAL_US] // count, p99_us
+
+    def thinning_statistics(self):
+        """
+        Returns the UART model results since start(), as a tuple
+        (deferred events, dropped events, maximum note latency,
+        maximum backlog), times in microseconds. Dropped events were
+        deferred and replaced by a later value before being sent.
+        The note latency is the time from the deadline of a note
+        until the UART finishes sending it.
+        """
+        values = self._values
+        return values[_DEFERRED_EVENTS], values[_DROPPED_EVENTS], \
+            values[_MAX_NOTE_LATENCY_US], values[_MAX_BACKLOG_US]
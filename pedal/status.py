@@ -0,0 +1,66 @@
+from array import array
+
+# Status fields, index into StatusChannel.values
+PLAYING = 0
+TEMPO = 1
+TIME = 2
+LENGTH = 3
+TEMPO_PERCENT = 4
+FIELDS = 5
+
+# The sequence number stays even and within MicroPython small ints
+_SEQUENCE_MASK = 0x3ffffffe
+
+
+class StatusChannel:
+    """
+    Passes the player status from the player thread on core1 to the
+    user interface on core0, without a lock.
+
+    There is one writer and one reader. The writer makes the sequence
+    number odd while writing the fields, and even again after. The
+    reader copies the fields and retries if the sequence number was
+    odd or changed while copying, so the player never waits for the
+    user interface.
+    """
+
+    def __init__(self):
+        # Sequence number followed by the fields, written by the player
+        self._shared = array("L", [0] * (FIELDS + 1))
+        # Copy of the fields, for the user interface
+        self.values = array("L", [0] * FIELDS)
+        self._last_sequence = 0
+
+    def write(self, playing, tempo, time, length, tempo_percent=100):
+        """
+        Publish a new status, called by the player thread.
+        The tempo is the tempo of the song, played at tempo_percent.
+        """
+        shared = self._shared
+        shared[0] += 1
+        shared[1 + PLAYING] = playing
+        shared[1 + TEMPO] = tempo
+        shared[1 + TIME] = time
+        shared[1 + LENGTH] = length
+        shared[1 + TEMPO_PERCENT] = tempo_percent
+        shared[0] = (shared[0] + 1) & _SEQUENCE_MASK
+
+    def read(self):
+        """
+        Copy the latest status to values, called by the user interface.
+        Returns True if there is a new status since the last read.
+        """
+        shared = self._shared
+        values = self.values
+        while True:
+            sequence = shared[0]
+            if sequence == self._last_sequence:
+                return False
+            if sequence & 1:
+                # Player is writing, a few microseconds
+                continue
+            for field in range(FIELDS):
+                values[field] = shared[1 + field]
+            if shared[0] == sequence:
+                self._last_sequence = sequence
+                return True
@@ -35,6 +35,7 @@ DESCRIPTION
 
 import time
 import os
+from array import array
 
 # Wrapper for python/micropython functions
 try:
@@ -45,7 +46,8 @@ try:
     time_sleep_us = lambda usec: time.sleep_us( usec )
     ticks_now_us = lambda: time.ticks_us()
     ticks_diff_us = lambda x, y: time.ticks_diff( x, y )
-    os_path_abspath = lambda x : os.getcwd() + "/" + x
+    os_path_abspath = lambda x : x if x[0:1] == "/" \
+                                  else os.getcwd().rstrip("/") + "/" + x
 except ImportError:
     # Make this code work with cPython
     UPYTHON = False
@@ -117,12 +119,112 @@ _LAST_META_EVENT = const(0x7f)
 SYSEX = const(0xf0)
 ESCAPE = const(0xf7)
 
+# Event kinds, see MidiEvent.kind. Tight loops compare the kind instead
+# of calling is_meta(), is_tempo() or is_end().
+KIND_META = const(0)
+KIND_CHANNEL = const(1)
+KIND_SYSEX = const(2)
+KIND_TEMPO = const(3)
+KIND_END = const(4)
+
+# Event names and the property names for each event status, for
+# MidiEvent.__str__, filled in when the first event is printed.
+_event_names = None
+_property_names = {}
+
 # Define a static buffer for MidiParser of this size in bytes.
 # This buffer is used for the data of meta and sysex messages
 # If there are larger messages in a file, this buffer will increase automatically
 # to accomodate the larger data
 _INITIAL_EVENT_BUFFER_SIZE = const(20)
 
+# Compiled event cache file format, see CompiledMidiFile.
+# The file starts with a header:
+#   4 bytes: magic/version
+#   4 bytes: size of the source midi file, little endian
+#   4 bytes: modification time of the source midi file, little endian
+#   4 bytes: number of records, little endian
+#   4 bytes: length of the song in microseconds, little endian
+# followed by fixed width records of 8 bytes each:
+#   4 bytes: absolute time of the event in microseconds, little endian
+#   1 byte: event status byte (channel events) or meta event type
+#   3 bytes: data, zero padded (channel events) or tempo (SET_TEMPO)
+# SYSEX and ESCAPE records store the data length in the first two data
+# bytes (little endian) and are followed by the data, zero padded to
+# a multiple of 8 bytes.
+_COMPILED_MAGIC = b"UMC1"
+_COMPILED_HEADER_SIZE = const(20)
+_COMPILED_RECORD_SIZE = const(8)
+_COMPILED_EXTENSION = ".umc"
+
+# MidiWriter writes the track data in chunks of this size
+_WRITER_CHUNK_SIZE = const(512)
+
+# Event dump format, see EventDump. Records of 8 bytes:
+#   4 bytes: delta time in microseconds, little endian
+#   1 byte: event status byte (channel events) or meta event type
+#   2 bytes: data, zero padded (channel events)
+#   1 byte: data length of meta, sysex and escape events, the data
+#           follows the record, truncated to 255 bytes
+_DUMP_RECORD_SIZE = const(8)
+_DUMP_CSV_HEADER = "delta_us,status,data1,data2,data\n"
+
+# Default time between checkpoints for MidiFile.seek, in microseconds
+_CHECKPOINT_INTERVAL_US = const(10_000_000)
+
+# Times in microseconds since the start of the file are kept in 32 bit
+# unsigned fields: the compiled event cache and the tempo map arrays.
+# This is about 71 minutes.
+_MAX_TIME_US = 0xffffffff
+
+# Layout of the _ChaseState values: program change and pitch wheel
+# (2 bytes) for each channel, then 128 controllers for each channel
+_CHASE_PROGRAMS = const(0)
+_CHASE_PITCHWHEEL = const(16)
+_CHASE_CONTROLLERS = const(48)
+_CHASE_SIZE = const(48+16*128)
+
+
+# Priority queue to merge the tracks of a file, see MidiFile._track_merger.
+# Heap entries are lists [miditicks, track number, track], the track number
+# breaks ties so that tracks with events at the same time keep the track order.
+if UPYTHON:
+    # Micropython's heapq has no heapreplace, use a small binary heap
+    def _heap_sift_down( heap, position ):
+        # Move heap[position] down until both children are larger
+        size = len(heap)
+        item = heap[position]
+        child = 2*position + 1
+        while child < size:
+            if child + 1 < size and heap[child+1] < heap[child]:
+                child += 1
+            if not heap[child] < item:
+                break
+            heap[position] = heap[child]
+            position = child
+            child = 2*position + 1
+        heap[position] = item
+
+    def _heapify( heap ):
+        for position in range( len(heap)//2 - 1, -1, -1 ):
+            _heap_sift_down( heap, position )
+
+    def _heapreplace( heap, item ):
+        smallest = heap[0]
+        heap[0] = item
+        _heap_sift_down( heap, 0 )
+        return smallest
+
+    def _heappop( heap ):
+        last = heap.pop()
+        if not heap:
+            return last
+        return _heapreplace( heap, last )
+else:
+    from heapq import heapify as _heapify, \
+        heapreplace as _heapreplace, \
+        heappop as _heappop
+
 
 # Parse midi variable length number format,
 # used for time deltas and meta message lengths
@@ -149,9 +251,59 @@ def _midi_number_to_int( midi_data ):
 
 
 
+def _bisect_right( values, value ):
+    # Returns the index where value would be inserted in the sorted
+    # array values, after any entries equal to value.
+    low = 0
+    high = len(values)
+    while low < high:
+        middle = (low+high)//2
+        if value < values[middle]:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def _int_to_midi_number( value ):
+    # Converts a integer to a midi variable length number, returns bytes.
+    # This is the reverse of _midi_number_to_int.
+    midi_number = bytearray( ( value & 0x7f, ) )
+    value >>= 7
+    while value:
+        midi_number.append( 0x80 | ( value & 0x7f ) )
+        value >>= 7
+    return bytes( reversed( midi_number ) )
+
+
+def _time_division( division ):
+    # Decodes the division field of the MIDI file header, returns
+    # ( miditicks_per_quarter, smpte_tempo ).
+    # For metrical time, the division is the MIDI ticks per quarter note
+    # and smpte_tempo is None, the tempo is set by SET_TEMPO events.
+    # For SMPTE time, the upper byte is minus the frames per second
+    # (-24, -25, -29 or -30) and the lower byte the MIDI ticks per frame.
+    # The time is then fixed, expressed as a tempo of smpte_tempo
+    # microseconds per miditicks_per_quarter MIDI ticks, so that the
+    # time calculations are the same for both kinds of time division
+    # and stay in integers: 1 second per frames*ticks per frame,
+    # or 1.001 seconds per 30*ticks per frame for 29.97 frames per
+    # second (drop frame, stored as -29).
+    if division <= 32767:
+        return division, None
+    frames_per_second = 256 - ( division >> 8 )
+    miditicks_per_frame = division & 0xff
+    if frames_per_second not in ( 24, 25, 29, 30 ) or miditicks_per_frame == 0:
+        raise ValueError(
+            f"Midi SMPTE time division 0x{division:04x} not valid" )
+    if frames_per_second == 29:
+        return 30*miditicks_per_frame, 1_001_000
+    return frames_per_second*miditicks_per_frame, 1_000_000
+
 def _process_events( event_iterator,
                     miditicks_per_quarter,
-                    reuse_event_object ):
+                    reuse_event_object,
+                    smpte_tempo=None ):
     # This function iterates through the provided event iterator,
     # getting one MidiEvent at a time, and processes MIDI meta set tempo
     # events to convert the time delta in MIDI ticks to time delta in microseconds,
@@ -161,9 +313,11 @@ def _process_events( event_iterator,
     # If the reuse_event_object parameter is set to False, a independent deep copy
     # of each event is returned. If the reuse_event_object is True, the same
     # object is returned over and over, to reduce CPU usage and RAM heap allocation.
+    # For SMPTE time division, smpte_tempo is the fixed tempo, see
+    # _time_division, and SET_TEMPO events do not change the tempo.
 
     # Start with default "microseconds per quarter" according to midi standard
-    tempo = 500_000
+    tempo = smpte_tempo or 500_000
 
     for event in event_iterator:
 
@@ -186,7 +340,8 @@ def _process_events( event_iterator,
         # event.delta_us calculation for next events.
         status = event.status
         if status == SET_TEMPO:
-            tempo = event.tempo
+            if smpte_tempo is None:
+                tempo = event.tempo
 
         # If end_of_track is seen, stop processing events
         elif status == END_OF_TRACK:
@@ -203,6 +358,25 @@ def _process_events( event_iterator,
 
 
 
+def _play_events( midi_event_iterator ):
+    # Iterate through the events, sleep until the event has to
+    # take place, and yield the event. Times are measured from the start
+    # of playback, so there is no cumulative drift.
+    playing_started_at = ticks_now_us()
+    midi_time = 0
+
+    for event in midi_event_iterator:
+        midi_time += event.delta_us
+
+        now = ticks_now_us()
+        playing_time = ticks_diff_us( now, playing_started_at )
+
+        wait_time = (midi_time - playing_time)
+        if wait_time > 0:
+            time_sleep_us( wait_time )
+        yield event
+
+
 class _MidiParser:
     # This class instantiates a MidiParser, the class constructor
     # accepts a iterable with MIDI events in MIDI file format, i.e.
@@ -394,11 +568,239 @@ class _MidiParser:
                 " not supported in midi files")
 
 
+class _MidiCursorParser:
+    # This class parses the events of a track directly out of a
+    # buffer, moving an index through the buffer, instead of getting the
+    # data byte per byte from a generator like _MidiParser does.
+    # The buffer is either the complete track (buffer_size=0) or a portion
+    # of the track, refilled from the file when the index reaches
+    # the end, carrying over an incomplete event to the next portion.
+    # Events returned are the same as with _MidiParser.
+    def __init__( self, track, position=0, running_status=None ):
+        # Initialize a parser for the MidiTrack track. The parsing
+        # is then done with the parse_events method.
+        # Parsing can start in the middle of the track, at a position
+        # (relative to the start of the track data) where an event starts,
+        # with the running status in effect at that position.
+        self._track = track
+        self._start = position
+
+        # The first event cannot be a "running status event", unless
+        # starting in the middle of the track
+        self._running_status = running_status
+
+        # Position of the start of the last event returned, and running
+        # status just before that event. A parser started with these
+        # values returns the last event again.
+        self.event_position = position
+        self.event_running_status = running_status
+
+        # The most frequently used buffers are 1 and 2 bytes long
+        # For CPU/RAM efficiency, preallocate these buffers.
+        # These two buffers are used only for midi channel events
+        self._buffer1 = memoryview(bytearray(1))
+        self._buffer2 = memoryview(bytearray(2))
+
+        # When reading from file: buffer, number of valid bytes in buffer,
+        # open file and number of bytes of the track not read yet
+        self._buffer = None
+        self._end = 0
+        self._file = None
+        self._unread_bytes = 0
+
+    def _parse_events( self ):
+        # This generator will parse the track and yield MidiEvent
+        # objects until end of data. As in _MidiParser, the same
+        # MidiEvent object is returned each time.
+        track = self._track
+        if track._track_data is not None:
+            # Track is in RAM, the track data is the buffer
+            self._buffer = track._track_data
+            self._end = len( self._buffer )
+            yield from self._parse_buffer( 0, self._start )
+            return
+
+        midifile = track._midifile
+        with open( midifile.filename, "rb" ) as file:
+            file.seek( track._start_position + self._start )
+            # Buffer must hold at least one complete midi channel event,
+            # and the start of a meta event up to the data length
+            self._buffer = bytearray( max( midifile.buffer_size, 16 ) )
+            self._file = file
+            self._unread_bytes = max( track._tracklen - self._start, 0 )
+            self._end = 0
+            yield from self._parse_buffer( self._start, 0 )
+
+    def _refill( self, position, needed ):
+        # Move the unprocessed data starting at position to the start
+        # of the buffer, and fill the rest of the buffer reading the file.
+        # The buffer grows if the needed number of bytes doesn't fit.
+        # Returns the new number of bytes in the buffer.
+        old_buffer = self._buffer
+        remaining = self._end - position
+        if needed > len(old_buffer):
+            self._buffer = bytearray( needed )
+        buffer = self._buffer
+        buffer[0:remaining] = old_buffer[position:self._end]
+
+        bytes_to_read = min( len(buffer) - remaining, self._unread_bytes )
+        bytes_read = self._file.readinto(
+                        memoryview( buffer )[remaining:remaining+bytes_to_read] )
+        self._unread_bytes -= bytes_read
+        if bytes_read < bytes_to_read:
+            # File is shorter than the track length in the chunk header
+            self._unread_bytes = 0
+        self._end = remaining + bytes_read
+        return self._end
+
+    def _parse_buffer( self, buffer_start, position ):
+        # Parse the events in the buffer, starting at position, refilling
+        # the buffer if reading from a file. buffer_start is the position
+        # of the start of the buffer in the track data.
+        # Exceptions are the same as in _MidiParser._parse_events
+        event = MidiEvent()
+        buffer1 = self._buffer1
+        buffer2 = self._buffer2
+        running_status = self._running_status
+        buffer = self._buffer
+        end = self._end
+        more_data = self._unread_bytes > 0
+        while True:
+            # A midi channel event has at most 7 bytes (4 bytes delta time
+            # plus 3 bytes), a meta event needs up to 10 bytes until
+            # the data length. Get more data if not in buffer.
+            if more_data and end - position < 10:
+                buffer_start += position
+                end = self._refill( position, 10 )
+                buffer = self._buffer
+                position = 0
+                more_data = self._unread_bytes > 0
+
+            if position >= end:
+                # End of data
+                return
+
+            event_position = buffer_start + position
+            event_running_status = running_status
+
+            try:
+                # Parse a delta time, most delta times are only 1 byte long.
+                data_byte = buffer[position]
+                position += 1
+                delta = data_byte
+                if data_byte > 0x7f:
+                    delta = data_byte & 0x7f
+                    while data_byte > 0x7f:
+                        data_byte = buffer[position]
+                        position += 1
+                        delta = (delta<<7) | (data_byte & 0x7f)
+
+                # Get event_status byte
+                event_status = buffer[position]
+                position += 1
+                if event_status < 0x80:
+                    # This is a running event, the event status byte is used
+                    # as first data byte
+                    if running_status is None:
+                        raise RuntimeError(
+                            "Midi running status without previous channel event")
+                    data_byte = event_status
+                    event_status = running_status
+                elif event_status <= _LAST_CHANNEL_EVENT:
+                    # Midi channel event, remember event status in case next
+                    # event is a running status event
+                    running_status = event_status
+                    data_byte = buffer[position]
+                    position += 1
+                elif event_status in ( _META_PREFIX, SYSEX, ESCAPE ):
+                    if event_status == _META_PREFIX:
+                        event_status = buffer[position]
+                        position += 1
+                        if not _FIRST_META_EVENT \
+                                <= event_status \
+                                <= _LAST_META_EVENT:
+                            raise ValueError(\
+                                f"Meta midi second event status byte (0x{event_status:x}) "
+                                "not in range 0x00-0x7f")
+
+                    # All non-channel events have a variable length field
+                    data_byte = buffer[position]
+                    position += 1
+                    data_length = data_byte & 0x7f
+                    while data_byte > 0x7f:
+                        data_byte = buffer[position]
+                        position += 1
+                        data_length = (data_length<<7) | (data_byte & 0x7f)
+
+                    if more_data and end - position < data_length:
+                        buffer_start += position
+                        end = self._refill( position, data_length )
+                        buffer = self._buffer
+                        position = 0
+                        more_data = self._unread_bytes > 0
+
+                    # Data is returned as memoryview of the buffer
+                    data = memoryview( buffer )[position:position+data_length]
+                    position += data_length
+                    if position > end:
+                        # Incomplete event at end of track
+                        return
+                    event._set( event_status, data, delta )
+                    self.event_position = event_position
+                    self.event_running_status = event_running_status
+                    yield event
+                    continue
+                else:
+                    # Real time and system common events are not expected in MIDI files.
+                    raise RuntimeError("Real time/system common event"
+                            f" status 0x{event_status:x}"
+                            " not supported in midi files")
+
+                # Midi channel event, 1 or 2 bytes of data
+                if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+                    data = buffer1
+                    data[0] = data_byte
+                else:
+                    data = buffer2
+                    data[0] = data_byte
+                    data[1] = buffer[position]
+                    position += 1
+
+            except IndexError:
+                # Incomplete event at end of the track data
+                return
+            except ( RuntimeError, ValueError ):
+                if position > end:
+                    # Not an error, this was data past the end of
+                    # the buffer, left from the last read
+                    return
+                raise
+
+            if position > end:
+                # Incomplete event at end of track, data past the
+                # end of buffer is from the last read
+                return
+
+            event._set( event_status, data, delta )
+            self.event_position = event_position
+            self.event_running_status = event_running_status
+            yield event
+
+
 class MidiEvent:
     """
     Represents a parsed midi event.
 
     """
+    # No instance dictionary, to save RAM and speed up attribute access.
+    # (Micropython accepts __slots__ but ignores it)
+    __slots__ = ( "_event_status_byte",
+                  "_data",
+                  "_status",
+                  "kind",
+                  "delta_miditicks",
+                  "delta_us" )
+
     @micropython.native
     def __init__( self ):
         """
@@ -425,11 +827,17 @@ class MidiEvent:
         #   self._data
         #       The raw data of the event. self.data is the read only
         #       property for self._data.
+        #
+        # MidiEvent public instance variables, besides the delta times:
+        #   self.kind
+        #       KIND_CHANNEL, KIND_SYSEX (sysex and escape events),
+        #       KIND_TEMPO, KIND_END or KIND_META (other meta events).
 
         self._event_status_byte = None
         self._data = None
 
         self._status = None
+        self.kind = None
         self.delta_miditicks = None
         self.delta_us = None
 
@@ -454,8 +862,17 @@ class MidiEvent:
         self._event_status_byte = event_status
         if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
             self._status = event_status & 0xf0
+            self.kind = KIND_CHANNEL
         else:
             self._status = event_status
+            if event_status == SET_TEMPO:
+                self.kind = KIND_TEMPO
+            elif event_status == END_OF_TRACK:
+                self.kind = KIND_END
+            elif event_status == SYSEX or event_status == ESCAPE:
+                self.kind = KIND_SYSEX
+            else:
+                self.kind = KIND_META
 
         self._data = data
         self.delta_miditicks = delta_miditicks
@@ -484,19 +901,20 @@ class MidiEvent:
         # This metod is used by __str___.
         # Computes the event name as a string. To keep memory
         # requirements at a minimum, instead of having a dictionary of
-        # names, this method uses the global variables of thid
-        # module as dictionary.
-
-        # Make a dictionary out of the global names of this module
-        # Exclude private names starting with _ and
-        # exclude names that don't translate to an integer
-        event_names_dict = { globals()[varname] : varname.lower() \
+        # names in the source, the dictionary is made from the global
+        # variables of this module, the first time an event is printed.
+        global _event_names
+        if _event_names is None:
+            # Exclude private names starting with _, the KIND_ codes
+            # and names that don't translate to an integer
+            _event_names = { globals()[varname] : varname.lower() \
                              for varname in globals() \
                              if isinstance(globals()[varname], int) \
-                             and varname[0:1] != "_" }
+                             and varname[0:1] != "_" \
+                             and varname[0:5] != "KIND_" }
 
         try:
-            name = event_names_dict[self._status]
+            name = _event_names[self._status]
         except KeyError:
             # Show meaningful information for custom event numbers
             if _FIRST_META_EVENT <= self._status <= _LAST_META_EVENT:
@@ -508,18 +926,35 @@ class MidiEvent:
     def _get_property_dict( self ):
         # This is used by __str__
         # Get values for allvalid @properties for
-        # this event, except the "data" property
+        # this event, except the "data" property.
+        # The names of the properties available for each status
+        # are found once and kept in _property_names.
+        names = _property_names.get( self._status )
+        if names is None:
+            names = []
+            for prop in dir(MidiEvent):
+                # Only @property, not methods or the __slots__ attributes
+                if prop[0:1] != "_" and isinstance( getattr( MidiEvent, prop ), property ):
+                    try:
+                        getattr( self, prop )
+                    except AttributeError:
+                        continue
+                    except IndexError:
+                        # Available, but the data of this event is too short
+                        pass
+                    names.append( prop )
+            names = tuple( names )
+            _property_names[self._status] = names
 
         property_dict = {}
-        for prop in dir(MidiEvent):
-            if prop[0:1] != "_":
-                try:
-                    value = getattr( self, prop )
-                    # Filter methods from the list
-                    if isinstance(value,(int,str)):
-                        property_dict[prop] = getattr(self, prop )
-                except AttributeError:
-                    pass
+        for prop in names:
+            try:
+                value = getattr( self, prop )
+            except ( AttributeError, IndexError ):
+                # Data too short for this property
+                continue
+            if isinstance(value,(int,str)):
+                property_dict[prop] = value
         return property_dict
 
     def __str__( self ):
@@ -867,6 +1302,7 @@ class MidiEvent:
         my_copy = MidiEvent()
         my_copy._event_status_byte = self._event_status_byte
         my_copy._status = self._status
+        my_copy.kind = self.kind
         my_copy._data = bytearray( self._data )
         my_copy.delta_miditicks = self.delta_miditicks
         my_copy.delta_us = self.delta_us
@@ -911,6 +1347,174 @@ class MidiEvent:
         #     raise AttributeError
         return self._event_status_byte.to_bytes( 1, "big") + self._data
 
+    @micropython.native
+    def unpack( self ):
+        """
+        Returns the event as a tuple ( event status byte, data byte 1,
+        data byte 2, delta_us ), to be used in tight loops instead of
+        the properties. For midi channel events the event status
+        byte includes the channel, and data byte 2 is 0 for program
+        change and aftertouch events. Data bytes are 0 for other
+        events, use kind to tell the events apart.
+        """
+        event_status = self._event_status_byte
+        if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+            data = self._data
+            if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+                return event_status, data[0], 0, self.delta_us
+            return event_status, data[0], data[1], self.delta_us
+        return event_status, 0, 0, self.delta_us
+
+    @micropython.native
+    def to_midi_into( self, buffer, offset=0 ):
+        """
+        Writes a midi channel event to buffer starting at offset, as
+        to_midi() would return it, without allocating memory. buffer
+        must have room for 3 bytes after offset.
+
+        Returns the number of bytes written, 2 or 3. Returns 0 for
+        meta, sysex and escape events and nothing is written.
+        """
+        event_status = self._event_status_byte
+        if not _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+            return 0
+        data = self._data
+        buffer[offset] = event_status
+        buffer[offset+1] = data[0]
+        if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+            return 2
+        buffer[offset+2] = data[1]
+        return 3
+
+
+class EventBatch:
+    """
+    A batch of events, stored in columns instead of one MidiEvent
+    object per event: the arrays delta_us, status, data1 and data2 have one
+    entry per event. status is the event status byte of midi channel
+    events (with the channel number), or the meta event type, SYSEX
+    or ESCAPE. The data of meta, sysex and escape events is kept in
+    a separate table, see data().
+
+    Filling and processing a batch allocates almost no objects, which
+    helps to avoid long garbage collections during playback. For example:
+
+        batch = EventBatch()
+        events = iter( MidiFile("example.mid", reuse_event_object=True) )
+        while batch.fill( events ):
+            for i in range( len(batch) ):
+                if batch.status[i] == NOTE_ON | 9:
+                    ... drum note batch.data1[i] after batch.delta_us[i] ...
+
+    delta_miditicks is not stored.
+    """
+    def __init__( self, capacity=256 ):
+        """
+        Allocates the columns for up to capacity events.
+        """
+        self._capacity = capacity
+        self._length = 0
+        self.delta_us = array( "I", ( 0 for _ in range(capacity) ) )
+        self.status = bytearray( capacity )
+        self.data1 = bytearray( capacity )
+        self.data2 = bytearray( capacity )
+        # Data of meta, sysex and escape events, by index
+        self._data = {}
+
+        # Event and buffers used for iteration
+        self._event = MidiEvent()
+        self._buffer1 = memoryview( bytearray(1) )
+        self._buffer2 = memoryview( bytearray(2) )
+
+    def __len__( self ):
+        """
+        Returns the number of events in the batch.
+        """
+        return self._length
+
+    def clear( self ):
+        """
+        Removes all events from the batch.
+        """
+        self._length = 0
+        if self._data:
+            self._data.clear()
+
+    def is_full( self ):
+        """
+        Returns True if no more events can be added.
+        """
+        return self._length >= self._capacity
+
+    @micropython.native
+    def append( self, event ):
+        """
+        Adds a event at the end of the batch, the event must
+        have delta_us set. Raises IndexError if the batch is full.
+        """
+        index = self._length
+        if index >= self._capacity:
+            raise IndexError( "EventBatch is full" )
+        event_status = event._event_status_byte
+        data = event._data
+        self.delta_us[index] = event.delta_us
+        self.status[index] = event_status
+        if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+            self.data1[index] = data[0]
+            if len(data) > 1:
+                self.data2[index] = data[1]
+        else:
+            self._data[index] = bytes( data )
+        self._length = index + 1
+
+    def fill( self, event_iterator ):
+        """
+        Clears the batch and adds events from event_iterator until the
+        batch is full or there are no more events.
+        Returns the number of events in the batch, 0 at the end.
+        """
+        self.clear()
+        for event in event_iterator:
+            self.append( event )
+            if self._length >= self._capacity:
+                break
+        return self._length
+
+    def data( self, index ):
+        """
+        Returns the data of the event at index, as MidiEvent.data
+        """
+        event_status = self.status[index]
+        if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+            if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+                return bytes( ( self.data1[index], ) )
+            return bytes( ( self.data1[index], self.data2[index] ) )
+        return self._data[index]
+
+    def __iter__( self ):
+        """
+        Iterates through the events in the batch. The same
+        MidiEvent object is returned for every event, as with
+        reuse_event_object=True in MidiFile.
+        """
+        event = self._event
+        buffer1 = self._buffer1
+        buffer2 = self._buffer2
+        for index in range( self._length ):
+            event_status = self.status[index]
+            if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+                if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+                    data = buffer1
+                    data[0] = self.data1[index]
+                else:
+                    data = buffer2
+                    data[0] = self.data1[index]
+                    data[1] = self.data2[index]
+            else:
+                data = self._data[index]
+            event._set( event_status, data, None )
+            event.delta_us = self.delta_us[index]
+            yield event
 
 
 class MidiTrack:
@@ -941,7 +1545,16 @@ class MidiTrack:
         # MTrk header in file has just been processed, get chunk length
         self._tracklen = int.from_bytes( file.read(4), "big" )
 
-        if midifile.buffer_size <= 0:
+        if midifile._mmap_view is not None:
+            # All tracks share the memory map of the file, the track
+            # data is a slice of the map, no data is copied.
+            start_position = file.tell()
+            self._track_data = midifile._mmap_view[start_position:
+                                                   start_position+self._tracklen]
+            self._start_position = None
+            # The map can't be positioned past the end of a truncated file
+            file.seek( start_position + len(self._track_data) )
+        elif midifile.buffer_size <= 0:
             # Read the entire track data to RAM
             self._track_data = file.read( self._tracklen )
             self._start_position = None
@@ -955,6 +1568,7 @@ class MidiTrack:
             file.seek( self._tracklen, 1 )
 
         self._track_parser = None
+        self._cursor = None
         self.event = None
         self.current_miditicks = None
 
@@ -975,8 +1589,7 @@ class MidiTrack:
         buffer = bytearray( self._midifile.buffer_size )
 
         # Open file again to read the track
-        # DCB- quick hack to fix FILE NOT FOUND errors: 
-        with open( self._midifile.filename.strip("//"), "rb") as file:
+        with open( self._midifile.filename, "rb") as file:
             unread_bytes = self._tracklen
             file.seek( self._start_position )
             while True:
@@ -995,6 +1608,13 @@ class MidiTrack:
             return self._buffered_data_generator()
         return self._file_data_generator()
 
+    def _get_event_parser( self ):
+        # Sets up the generator to parse the events of the track, with
+        # the parser selected by the cursor_parser parameter of MidiFile
+        if self._midifile.cursor_parser:
+            return _MidiCursorParser( self )._parse_events()
+        return _MidiParser( self._get_midi_data() )._parse_events()
+
 
     def __iter__( self ):
         """
@@ -1022,11 +1642,12 @@ class MidiTrack:
         # Get the parser to return event by event, process set tempo meta events,
         # calculate delta_us and ensure END_OF_TRACK present at the end.
         return _process_events(
-                _MidiParser( self._get_midi_data() )._parse_events(),
-                self._midifile.miditicks_per_quarter,
-                self._midifile.reuse_event_object )
+                self._get_event_parser(),
+                self._midifile._miditicks_per_quarter,
+                self._midifile.reuse_event_object,
+                self._midifile._smpte_tempo )
 
-    def _track_parse_start( self ):
+    def _track_parse_start( self, resume=None ):
         # This is an internal method called by MidiFile for multitrack processing.
         # It starts a parser on the track to return event for event, and
         # keeps the sum of MIDI ticks since the beginning of the track.
@@ -1036,14 +1657,37 @@ class MidiTrack:
 
         # The events can then retrieved by track.event and advanced to the next
         # with track_parse_next.
-        self._track_parser = _MidiParser( self._get_midi_data() )._parse_events()
+
+        # If resume is specified, parsing starts in the middle of the track.
+        # resume is a tuple with position of an event in the track data,
+        # running status at that position and MIDI ticks since the
+        # beginning of the track before that event, see _track_resume_point.
+        # The cursor parser is used to resume.
+        if resume is None:
+            self._cursor = None
+            self._track_parser = self._get_event_parser()
+            miditicks = 0
+        else:
+            position, running_status, miditicks = resume
+            self._cursor = _MidiCursorParser( self, position, running_status )
+            self._track_parser = self._cursor._parse_events()
 
         # Get first event to get things going...
         self.event = next( self._track_parser )
-        self.current_miditicks = self.event.delta_miditicks
+        self.current_miditicks = miditicks + self.event.delta_miditicks
 
         return self
 
+    def _track_resume_point( self ):
+        # Returns the information to resume parsing the track at the
+        # current event with _track_parse_start. Valid if the track was
+        # started with a resume point, and the current event has not been
+        # modified yet by the track merger.
+        cursor = self._cursor
+        return ( cursor.event_position,
+                 cursor.event_running_status,
+                 self.current_miditicks - self.event.delta_miditicks )
+
 
     @micropython.native
     def _track_parse_next( self ):
@@ -1058,9 +1702,9 @@ class MidiTrack:
     @micropython.native
     def __lt__( self, compare_to ):
         """
-        Used internally by the min function to compare the current time in miditicks
-        of the different tracks, the goal is to find the next midi event
-        of all tracks (the one with the smallest time since the beginning of the track)
+        Compares the current time in miditicks of two tracks, the track
+        with the next midi event is the one with the smallest time since
+        the beginning of the track
         """
         # Compares the _get_current_miditicks value of this track to
         # the same value of another track. Track1 > track2 means that
@@ -1073,6 +1717,197 @@ class MidiTrack:
     def _get_current_miditicks(self):
         return self.current_miditicks
 
+class _ChaseState:
+    # Keeps the last program change, pitch wheel and controller values
+    # of each channel, to send them before starting to play from the
+    # middle of a file ("chasing" the channel state).
+    def __init__( self, snapshot=b"" ):
+        # One byte per value, see _CHASE_SIZE. 0xff means not set yet,
+        # the values in midi channel events are 0x00-0x7f.
+        self._values = bytearray( b"\xff" * _CHASE_SIZE )
+
+        # Restore a state saved with snapshot()
+        for index in range( 0, len(snapshot), 3 ):
+            self._values[ (snapshot[index]<<8) | snapshot[index+1] ] = snapshot[index+2]
+
+    @micropython.native
+    def update( self, event ):
+        # Update the state with a event
+        status = event._status
+        if status == CONTROL_CHANGE:
+            data = event._data
+            self._values[ _CHASE_CONTROLLERS
+                          + ( (event._event_status_byte & 0x0f) << 7 )
+                          + data[0] ] = data[1]
+        elif status == PROGRAM_CHANGE:
+            self._values[ _CHASE_PROGRAMS
+                          + (event._event_status_byte & 0x0f) ] = event._data[0]
+        elif status == PITCHWHEEL:
+            data = event._data
+            index = _CHASE_PITCHWHEEL + 2*(event._event_status_byte & 0x0f)
+            self._values[index] = data[0]
+            self._values[index+1] = data[1]
+
+    def snapshot( self ):
+        # Returns the values set as compact bytes, 3 bytes per value:
+        # 2 bytes index, 1 byte value. Usually only a few values are set.
+        snapshot = bytearray()
+        for index, value in enumerate( self._values ):
+            if value != 0xff:
+                snapshot += bytes( ( index >> 8, index & 0xff, value ) )
+        return bytes( snapshot )
+
+    def events( self, tempo ):
+        # Generator for the events to restore the state, all with delta
+        # time 0: set tempo, and then for each channel: bank select,
+        # program change, the other controllers and pitch wheel.
+        yield MidiEvent()._set( SET_TEMPO, tempo.to_bytes( 3, "big" ), 0 )
+
+        values = self._values
+        for channel in range(16):
+            controllers = _CHASE_CONTROLLERS + (channel<<7)
+            # Bank select (MSB and LSB) must preceed the program change
+            for controller in ( 0, 32 ):
+                if values[controllers+controller] != 0xff:
+                    yield MidiEvent()._set( CONTROL_CHANGE | channel,
+                        bytearray( ( controller, values[controllers+controller] ) ),
+                        0 )
+
+            if values[_CHASE_PROGRAMS+channel] != 0xff:
+                yield MidiEvent()._set( PROGRAM_CHANGE | channel,
+                    bytearray( ( values[_CHASE_PROGRAMS+channel], ) ),
+                    0 )
+
+            for controller in range(128):
+                if values[controllers+controller] != 0xff \
+                        and controller not in ( 0, 32 ):
+                    yield MidiEvent()._set( CONTROL_CHANGE | channel,
+                        bytearray( ( controller, values[controllers+controller] ) ),
+                        0 )
+
+            index = _CHASE_PITCHWHEEL + 2*channel
+            if values[index] != 0xff:
+                yield MidiEvent()._set( PITCHWHEEL | channel,
+                    bytearray( values[index:index+2] ),
+                    0 )
+
+
+class TempoMap:
+    """
+    The tempo map of a MIDI file, built once with all the SET_TEMPO
+    events of the file. Converts the time since the start of the file
+    between MIDI ticks and microseconds with a binary search, without
+    going through the events of the file.
+
+    The tempo map is for format type 0 and 1 files, and is usually
+    obtained with MidiFile.tempo_map.
+
+    The conversion rounds once per tempo change, while
+    iterating through the file rounds each event.delta_us, so the
+    results may differ by a few microseconds.
+
+    Times of the tempo changes are kept in 32 bits, tempo changes after
+    about 71 minutes are left out. Times up to there are converted
+    exactly, see length_us().
+    """
+    def __init__( self, midifile ):
+        """
+        Builds the tempo map parsing all tracks of the MidiFile.
+        """
+        self._miditicks_per_quarter = midifile._miditicks_per_quarter
+        smpte_tempo = midifile._smpte_tempo
+
+        # Get all tempo changes, with time in MIDI ticks since start
+        # of file. The track number and position in the track
+        # keep the order of simultaneous tempo changes in the merged file.
+        tempo_changes = []
+        length_miditicks = 0
+        for track_number, track in enumerate( midifile.tracks ):
+            track_miditicks = 0
+            for event in track._get_event_parser():
+                track_miditicks += event.delta_miditicks
+                if event._status == SET_TEMPO and smpte_tempo is None:
+                    tempo_changes.append( ( track_miditicks,
+                                            track_number,
+                                            len(tempo_changes),
+                                            event.tempo ) )
+                elif event._status == END_OF_TRACK:
+                    break
+            length_miditicks = max( length_miditicks, track_miditicks )
+        tempo_changes.sort()
+        self._length_miditicks = length_miditicks
+
+        # The tempo map is kept as three sorted arrays, one entry per
+        # tempo change: time in MIDI ticks, time in microseconds and tempo
+        # from there on. Start with the default tempo of the MIDI standard.
+        # With SMPTE time division there is one fixed tempo,
+        # see _time_division.
+        self._miditicks = array( "L", [0] )
+        self._us = array( "L", [0] )
+        self._tempos = array( "L", [smpte_tempo or 500_000] )
+        for miditicks, _, _, tempo in tempo_changes:
+            if miditicks == self._miditicks[len(self._miditicks)-1]:
+                # Simultaneous tempo changes, the last one is valid
+                self._tempos[len(self._tempos)-1] = tempo
+            else:
+                time_us = self.ticks_to_us( miditicks )
+                if time_us > _MAX_TIME_US:
+                    # Sorted, the next ones are later too
+                    break
+                self._us.append( time_us )
+                self._miditicks.append( miditicks )
+                self._tempos.append( tempo )
+
+    def ticks_to_us( self, miditicks ):
+        """
+        Converts a time in MIDI ticks since start of file to microseconds.
+        """
+        index = _bisect_right( self._miditicks, miditicks ) - 1
+        miditicks_per_quarter = self._miditicks_per_quarter
+        return self._us[index] \
+               + ( ( miditicks - self._miditicks[index] ) * self._tempos[index]
+                   + miditicks_per_quarter//2 ) // miditicks_per_quarter
+
+    def us_to_ticks( self, time_us ):
+        """
+        Converts a time in microseconds since start of file to MIDI ticks.
+        """
+        index = _bisect_right( self._us, time_us ) - 1
+        tempo = self._tempos[index]
+        return self._miditicks[index] \
+               + ( ( time_us - self._us[index] ) * self._miditicks_per_quarter
+                   + tempo//2 ) // tempo
+
+    def tempo_at( self, miditicks ):
+        """
+        Returns the tempo valid at a time in MIDI ticks since start of file.
+        For SMPTE time division, the tempo is fixed: microseconds per
+        frames per second times the midi ticks per frame (with 30 frames
+        per second for 29.97 frames per second).
+        """
+        return self._tempos[ _bisect_right( self._miditicks, miditicks ) - 1 ]
+
+    def length_ticks( self ):
+        """
+        Returns the length of the file in MIDI ticks.
+        """
+        return self._length_miditicks
+
+    def length_us( self ):
+        """
+        Returns the length of the file in microseconds, at most
+        0xffffffff (about 71 minutes).
+        """
+        return min( self.ticks_to_us( self._length_miditicks ), _MAX_TIME_US )
+
+    def __len__( self ):
+        """
+        Returns the number of tempo changes, including the
+        initial default tempo.
+        """
+        return len( self._miditicks )
+
+
 class MidiFile:
     """
     Parses a MIDI file.
@@ -1083,7 +1918,9 @@ class MidiFile:
     def __init__( self,
                   filename,
                   buffer_size=100,
-                  reuse_event_object=False ):
+                  reuse_event_object=False,
+                  cursor_parser=False,
+                  use_mmap=False ):
         """
         filename
 
@@ -1097,43 +1934,108 @@ class MidiFile:
 
         True will reuse the event object during parsing, using less RAM.
 
+        cursor_parser=False
+
+        True will parse events directly out of the track buffer with an
+        index, instead of processing the track data byte per byte with a
+        generator. This uses less CPU, the events returned are the same.
+
+        use_mmap=False
+
+        Only for cPython. True maps the file to memory, all tracks are
+        parsed from the shared memory map, without copying data and with
+        only one file descriptor per file. buffer_size is ignored.
+        Use close() or a with statement to release the memory map.
 
         """
 
         # Store parameters
         self._reuse_event_object = reuse_event_object
         self._buffer_size = buffer_size
+        self._cursor_parser = cursor_parser
+
+        self._tempo_map = None
+        self._checkpoints = None
+        self._checkpoint_miditicks = None
+
+        self._mmap = None
+        self._mmap_view = None
+        if use_mmap:
+            if UPYTHON:
+                raise ValueError( "use_mmap is only available with cPython" )
+            import mmap
+            with open( filename, "rb" ) as file:
+                # mmap keeps its own file descriptor, the file can be closed
+                self._mmap = mmap.mmap( file.fileno(), 0, access=mmap.ACCESS_READ )
+            self._mmap_view = memoryview( self._mmap )
+            # The memory map can be used as file to process the chunks
+            self._process_chunks( filename, self._mmap )
+        else:
+            with open( filename, "rb" ) as file:
+                self._process_chunks( filename, file )
+
+    def _process_chunks( self, filename, file ):
+        # Process file header and chunks of the open file (or memory map)
+        # First chunk must be MThd midi header, process header and validate
+        self._format_type, \
+            number_of_chunks, \
+            self._division = self._get_header( file )
+        self._miditicks_per_quarter, \
+            self._smpte_tempo = _time_division( self._division )
+        # Get absolute path to file. Storing
+        # a relative path results in error if the calling
+        # program changes the working directory
+        self._filename = os_path_abspath( filename )
+
+        # Get all track objects of the file.
+        # Disregard the number of chunks, read the real number of tracks present.
+        self.tracks = []
+        for _ in range(number_of_chunks):
+            track_id = file.read(4).decode( "latin-1" )
+            # Only process MTrk chunks
+            if track_id == "MTrk":
+                self.tracks.append( MidiTrack( file, self ) )
+            else:
+                # Skip non-track chunk,
+                # parse chunk using MidiTrack but don't append to track list
+                MidiTrack( file, self )
 
-        # Process file
-        with open( filename, "rb" ) as file:
-
-            # First chunk must be MThd midi header, process header and validate
-            self._format_type, \
-                number_of_chunks, \
-                self._miditicks_per_quarter = self._get_header( file )
-            # Get absolute path to file. Storing
-            # a relative path results in error if the calling
-            # program changes the working directory
-            self._filename = os_path_abspath( filename )
-
-            # Get all track objects of the file.
-            # Disregard the number of chunks, read the real number of tracks present.
-            self.tracks = []
-            for _ in range(number_of_chunks):
-                track_id = file.read(4).decode( "latin-1" )
-                # Only process MTrk chunks
-                if track_id == "MTrk":
-                    self.tracks.append( MidiTrack( file, self ) )
-                else:
-                    # Skip non-track chunk,
-                    # parse chunk using MidiTrack but don't append to track list
-                    MidiTrack( file, self )
+    def close( self ):
+        """
+        Releases the memory map when the MidiFile was created with use_mmap=True.
+        The tracks can't be iterated after close, and iterations in progress
+        will fail. For other MidiFile objects this does nothing, files are
+        opened only while iterating.
+
+        MidiFile can also be used in a with statement, to close
+        the MidiFile automatically:
+            with MidiFile("example.mid", use_mmap=True) as midi_file:
+                for event in midi_file:
+                    print(event)
+        """
+        if self._mmap is None:
+            return
+        for track in self.tracks:
+            track._track_data.release()
+        self._mmap_view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # An event still holds data of the map (reuse_event_object=True),
+            # the map is closed when that event is deleted.
+            pass
+        self._mmap = None
+
+    def __enter__( self ):
+        return self
 
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
 
     def _get_header( self, file ):
         # Decodes the MIDI file header, returns the
         # values of the header:
-        # format type (0-2), number of data chunks, MIDI ticks per quarter note
+        # format type (0-2), number of data chunks, time division
 
         track_id = file.read(4).decode( "latin-1" )
         if track_id != "MThd":
@@ -1164,13 +2066,10 @@ class MidiFile:
         # Get number of data chunks (track chunks) in the file
         number_of_chunks = int.from_bytes( header_data[2:4], "big" )
 
-        # Get pulses per beat
-        miditicks_per_quarter = int.from_bytes( header_data[4:6], "big" )
-
-        if miditicks_per_quarter > 32767:
-            raise ValueError("Midi SMPTE time codes not supported")
+        # Get pulses per beat, or SMPTE frames per second and ticks per frame
+        division = int.from_bytes( header_data[4:6], "big" )
 
-        return format_type, number_of_chunks, miditicks_per_quarter
+        return format_type, number_of_chunks, division
 
     @property
     def format_type( self ):
@@ -1184,9 +2083,24 @@ class MidiFile:
         """
         Return the midi ticks per quarter note (also called pulses per beat)
         parameter in the MIDI header of the file.
+        Returns None if the file uses SMPTE time division, see division.
         """
+        if self._smpte_tempo is not None:
+            return None
         return self._miditicks_per_quarter
 
+    @property
+    def division( self ):
+        """
+        Return the time division of the MIDI header of the file, as stored:
+        the midi ticks per quarter note, or for SMPTE time division a
+        value larger than 0x7fff with minus the frames per second
+        in the upper byte and the midi ticks per frame in the lower byte.
+        For SMPTE, the time of the events is fixed by the frame rate,
+        and SET_TEMPO events don't change the delta_us of the events.
+        """
+        return self._division
+
     @property
     def filename( self ):
         """
@@ -1217,36 +2131,72 @@ class MidiFile:
         """
         return self._reuse_event_object
 
-    def _track_merger( self ):
+    @property
+    def tempo_map( self ):
+        """
+        Return the TempoMap of the file, to convert between MIDI ticks
+        and microseconds. The tempo map is built the first time it
+        is used, parsing all tracks once.
+        """
+        if self._tempo_map is None:
+            self._tempo_map = TempoMap( self )
+        return self._tempo_map
+
+    @property
+    def cursor_parser( self ):
+        """
+        Return the value of cursor_parser.
+        True: events are parsed directly out of the track buffer with an index.
+
+        False: the track data is processed byte by byte with a generator.
+        """
+        return self._cursor_parser
+
+    def _track_merger( self, checkpoint=None ):
         # Merges all tracks of a multitrack format 1 file
+        # If a checkpoint is given (see _checkpoint_scan), merging
+        # starts at the checkpoint instead of the beginning of the file.
+
+        if checkpoint is None:
+            resume_points = [ None ] * len( self.tracks )
+            current_miditicks = 0
+        else:
+            _, current_miditicks, _, resume_points = checkpoint
 
         # Iterate through each track, set up one iterator for each track
         # For this code to work, the track interator will always yield
         # a END_OF_TRACK event at the end of the track.
-        play_tracks = [ track._track_parse_start() for track in self.tracks ]
+        # The tracks are kept in a heap, ordered by the time of their
+        # current event, so selecting the next event is O(log(tracks)).
+        play_tracks = [ [ track._track_parse_start( resume ).current_miditicks,
+                          track_number,
+                          track ]
+                        for track_number, ( track, resume ) \
+                            in enumerate( zip( self.tracks, resume_points ) ) ]
+        _heapify( play_tracks )
 
         # Current miditicks keeps the time, in MIDI ticks, since start of track
         # of the last event returned
-        current_miditicks = 0
 
         while True:
             # From all tracks, select the track with the next event, this is
-            # the one with the lowest "current MIDI ticks time".
-            next_track = min( play_tracks ) # Uses the __lt__ function of track
+            # the one with the lowest "current MIDI ticks time", the
+            # top of the heap.
+            heap_entry = play_tracks[0]
+            track_miditicks = heap_entry[0]
+            next_track = heap_entry[2]
 
             # Get the current event of the selected track
             event = next_track.event
 
             # Adjust event miditicks to time difference with last event overall,
             # replacing delta time with last event in the event's track
-            track_miditicks = next_track._get_current_miditicks()
             event.delta_miditicks = track_miditicks - current_miditicks
 
             # If end_of_track is seen, don't continue to process this track
-            if event.status == END_OF_TRACK:
-                # Delete the track from the list of tracks being processed
-                track_index = play_tracks.index(next_track)
-                del play_tracks[track_index]
+            if event._status == END_OF_TRACK:
+                # Delete the track from the tracks being processed
+                _heappop( play_tracks )
 
                 # If all tracks have ended, stop processing file
                 if len(play_tracks) == 0:
@@ -1269,6 +2219,10 @@ class MidiFile:
             # overwrite the yielded message if reuse_event_object=True.
             next_track._track_parse_next()
 
+            # Put the track back in the heap with the time of its new event
+            heap_entry[0] = next_track.current_miditicks
+            _heapreplace( play_tracks, heap_entry )
+
 
     def __iter__( self ):
         """
@@ -1284,7 +2238,8 @@ class MidiFile:
             # This will yield a single END_OF_TRACK event.
             return _process_events( iter([]),
                     self._miditicks_per_quarter,
-                    self._reuse_event_object )
+                    self._reuse_event_object,
+                    self._smpte_tempo )
 
         # For format 2, iteration over the track to be played should be used...
         if self._format_type == 2 and len(self.tracks) > 1:
@@ -1304,27 +2259,169 @@ class MidiFile:
         # file should really have only one track, according to the standard.
         return _process_events( self._track_merger(),
                     self._miditicks_per_quarter,
-                    self._reuse_event_object )
+                    self._reuse_event_object,
+                    self._smpte_tempo )
+
+    def flatten( self, filename ):
+        """
+        Writes a format type 0 MIDI file with all the tracks of this
+        MIDI file merged into a single track.
+
+        The events and their order are the same as when iterating
+        through this MidiFile, and the MIDI ticks per quarter note of the
+        header are kept, so set tempo events still apply. A flattened file
+        needs no track merge during playback and uses one file
+        (and one buffer) instead of one per track.
+
+        A format type 2 file can't be flattened, RuntimeError is raised.
+        """
+        if self._format_type == 2 and len(self.tracks) > 1:
+            raise RuntimeError(
+                    "It's not possible to merge tracks of a MIDI format type 2 file")
+
+        if len(self.tracks) == 0:
+            # MidiWriter adds the END_OF_TRACK event
+            events = ()
+        else:
+            events = self._track_merger()
+
+        with MidiWriter( filename,
+                         format_type=0,
+                         miditicks_per_quarter=self._division ) as writer:
+            writer.write_track( events )
 
     def length_us( self ):
         """
         Returns the length of the MidiFile in microseconds.
+        This uses the tempo map, see tempo_map. Longer files
+        return 0xffffffff (about 71 minutes).
         """
-        # Returns the duration of playback time of the midi file microseconds
+        return self.tempo_map.length_us()
 
-        # Start playing time at 0, in case there are no events
-        playback_time_us = 0
+    def build_checkpoints( self, interval_us=_CHECKPOINT_INTERVAL_US ):
+        """
+        Parses the file once, and remembers a checkpoint each interval_us
+        microseconds. With the checkpoints, seek() starts parsing at the
+        checkpoint just before the start position, instead of at the
+        beginning of the file.
+
+        Each checkpoint has the position, running status and time of
+        each track, and the controller, program and pitch wheel values of
+        all channels at that point.
+
+        seek() builds the checkpoints with the default interval of 10 seconds
+        if they don't exist. Use a larger interval to use less RAM.
+        """
+        if self._format_type == 2 and len(self.tracks) > 1:
+            raise RuntimeError(
+                    "It's not possible to merge tracks of a MIDI format type 2 file")
+        tempo_map = self.tempo_map
+        checkpoints = []
+
+        # Merge tracks as _track_merger does, but with the cursor
+        # parser, to know the position of the events in the track
+        start = ( 0, None, 0 )
+        play_tracks = [ [ track._track_parse_start( start ).current_miditicks,
+                          track_number,
+                          track ]
+                        for track_number, track in enumerate( self.tracks ) ]
+        _heapify( play_tracks )
+
+        chase = _ChaseState()
+        current_miditicks = 0
+        next_checkpoint = 0
+        while play_tracks:
+            heap_entry = play_tracks[0]
+            track_miditicks = heap_entry[0]
+            next_track = heap_entry[2]
+
+            if track_miditicks >= next_checkpoint:
+                # A checkpoint is: time of the next event in MIDI ticks,
+                # time of the last event, state of the channels, and
+                # the resume point of each track
+                checkpoints.append( ( track_miditicks,
+                                      current_miditicks,
+                                      chase.snapshot(),
+                                      [ track._track_resume_point()
+                                        for track in self.tracks ] ) )
+                next_checkpoint = tempo_map.us_to_ticks(
+                    tempo_map.ticks_to_us( track_miditicks ) + interval_us )
 
-        # Iterate through all events
-        # The complete file must be processed to compute length
-        # Open another instance of the file, so that the current process is not disturbed
-        for event in MidiFile( self.filename ):
-            playback_time_us += event.delta_us
+            event = next_track.event
+            if event._status == END_OF_TRACK:
+                _heappop( play_tracks )
+                continue
 
-        # Return the last time seen, or 0 if there were no events
-        return playback_time_us
+            chase.update( event )
+            current_miditicks = track_miditicks
+            next_track._track_parse_next()
+            heap_entry[0] = next_track.current_miditicks
+            _heapreplace( play_tracks, heap_entry )
+
+        self._checkpoints = checkpoints
+        self._checkpoint_miditicks = array( "L",
+            [ checkpoint[0] for checkpoint in checkpoints ] )
+
+    def seek( self, start_us=None, start_ticks=None ):
+        """
+        Returns an iterator through the events of a format type 0 or 1
+        MIDI file, starting at start_us microseconds or start_ticks MIDI ticks
+        from the beginning of the file, without going through the events
+        before the start position.
+
+        The first events returned restore the state at the
+        start position: set tempo, and for each channel bank select,
+        program change, controllers and pitch wheel. These events have
+        delta_us = 0. The delta_us of the next event is the time from the
+        start position.
+        Notes sounding at the start position are not played.
+
+        Seeking uses the tempo map and the checkpoints,
+        see tempo_map and build_checkpoints(). start_us is limited
+        to 0xffffffff (about 71 minutes).
+        """
+        if start_ticks is None:
+            start_ticks = self.tempo_map.us_to_ticks(
+                min( start_us or 0, _MAX_TIME_US ) )
+        return _process_events( self._seek_events( start_ticks ),
+                                self._miditicks_per_quarter,
+                                self._reuse_event_object,
+                                self._smpte_tempo )
+
+    def _seek_events( self, start_ticks ):
+        # Generator used by seek(), yields the events to restore the state
+        # of the channels, and then the events from start_ticks onwards.
+        if len(self.tracks) == 0:
+            return
 
-    def play( self, track_number=None ):
+        if self._checkpoints is None:
+            self.build_checkpoints()
+
+        # Start at the last checkpoint at or before the start position
+        checkpoint = self._checkpoints[
+            _bisect_right( self._checkpoint_miditicks, start_ticks ) - 1 ]
+        chase = _ChaseState( checkpoint[2] )
+        current_miditicks = checkpoint[1]
+
+        # Go through the events before the start position, keeping
+        # the state of the channels only
+        events = self._track_merger( checkpoint )
+        for event in events:
+            event_miditicks = current_miditicks + event.delta_miditicks
+            if event_miditicks >= start_ticks \
+                    or event._status == END_OF_TRACK:
+                break
+            chase.update( event )
+            current_miditicks = event_miditicks
+
+        yield from chase.events( self.tempo_map.tempo_at( start_ticks ) )
+
+        # This event is the first at or after the start position
+        event.delta_miditicks = max( event_miditicks - start_ticks, 0 )
+        yield event
+        yield from events
+
+    def play( self, track_number=None, start_us=None, start_ticks=None ):
         """
         Iterate through the events of a MIDI file or a track,
         sleep until the event has to take place, and
@@ -1339,25 +2436,662 @@ class MidiFile:
         If a track number is specified, then that track number is played. This
         is intended for use with format type 2 files, to play a certain track.
 
+        start_us=None, start_ticks=None
+
+        Start playing the file at this position, in microseconds or
+        MIDI ticks from the beginning. See seek(). Only available
+        to play the complete file.
+
         """
 
-        if track_number is None:
+        if start_us is not None or start_ticks is not None:
+            if track_number is not None:
+                raise ValueError( "A start position can't be used with track_number" )
+            midi_event_iterator = self.seek( start_us, start_ticks )
+        elif track_number is None:
             midi_event_iterator = iter(self)
         else:
             midi_event_iterator = iter(self.tracks[track_number])
 
-        playing_started_at = ticks_now_us()
-        midi_time = 0
+        return _play_events( midi_event_iterator )
+
+    def compile( self, cache_filename ):
+        """
+        Parses the complete MIDI file once and writes the precompiled
+        event cache to cache_filename. See CompiledMidiFile for a
+        description and for the normal way to use the cache.
+
+        Returns the number of records written. Raises ValueError if
+        the file is longer than 0xffffffff microseconds (about 71 minutes).
+        If compiling fails the cache file is removed.
+        """
+        file_stat = os.stat( self._filename )
+        record_count = 0
+        event_time = 0
+        # Collect records and write them in larger portions
+        chunk = bytearray()
+        try:
+            with open( cache_filename, "wb" ) as file:
+                # Reserve space for the header. The header is written last,
+                # so an incomplete cache file is never taken as valid.
+                file.write( bytearray( _COMPILED_HEADER_SIZE ) )
+
+                for event in MidiFile( self._filename,
+                                       buffer_size=self._buffer_size,
+                                       reuse_event_object=True,
+                                       cursor_parser=self._cursor_parser ):
+                    event_time += event.delta_us
+                    status = event._status
+                    if _FIRST_CHANNEL_EVENT <= status <= _LAST_CHANNEL_EVENT:
+                        data = event._data
+                    elif status == SET_TEMPO:
+                        data = event._data[0:3]
+                    elif status == END_OF_TRACK:
+                        data = b""
+                    elif status in ( SYSEX, ESCAPE ):
+                        data = len(event._data).to_bytes( 2, "little" )
+                    else:
+                        # Other meta events are not needed for playback
+                        continue
+
+                    if event_time > _MAX_TIME_US:
+                        raise ValueError( "MIDI file longer than 71 minutes" )
+                    chunk += event_time.to_bytes( 4, "little" )
+                    chunk.append( event._event_status_byte )
+                    chunk += data
+                    chunk += bytearray( 3 - len(data) )
+                    record_count += 1
+
+                    if status in ( SYSEX, ESCAPE ):
+                        # Data follows the record, padded to a full record
+                        chunk += event._data
+                        chunk += bytearray( -len(event._data) % _COMPILED_RECORD_SIZE )
+
+                    if len(chunk) >= 512:
+                        file.write( chunk )
+                        chunk = bytearray()
+
+                file.write( chunk )
+
+                # Now the header, with the information to validate the cache
+                file.seek( 0 )
+                file.write( _COMPILED_MAGIC
+                            + ( file_stat[6] & 0xffffffff ).to_bytes( 4, "little" )
+                            + ( file_stat[8] & 0xffffffff ).to_bytes( 4, "little" )
+                            + record_count.to_bytes( 4, "little" )
+                            + event_time.to_bytes( 4, "little" ) )
+        except Exception:
+            # Don't leave an incomplete cache taking up space, it's
+            # never used, see CompiledMidiFile
+            try:
+                os.remove( cache_filename )
+            except OSError:
+                pass
+            raise
+
+        return record_count
+
+
+class CompiledMidiFile:
+    """
+    Plays a MIDI file from a precompiled event cache.
 
-        for event in midi_event_iterator:
-            midi_time += event.delta_us
+    The first time a MIDI file is opened, it is parsed once and a cache
+    file is written with fixed width records: absolute time in microseconds,
+    event status byte and data, with the tempo already applied. Iterating
+    through a CompiledMidiFile then reads these records with no MIDI
+    parsing at all, which is much faster than MidiFile.
 
-            now = ticks_now_us()
-            playing_time = ticks_diff_us( now, playing_started_at )
+    The cache is compiled again when the size or the modification time
+    of the MIDI file changes.
 
-            wait_time = (midi_time - playing_time)
-            if wait_time > 0:
-                time_sleep_us( wait_time )
-            yield event
+    The events returned are MidiEvent objects, with delta_us set.
+    Only the events needed for playback are kept: midi channel events,
+    SYSEX/ESCAPE, SET_TEMPO and one END_OF_TRACK at the end. Other meta
+    events are dropped and delta_miditicks is None.
+
+    Times are stored with 32 bits, so songs must be shorter than 71 minutes,
+    compiling a longer song raises ValueError.
+    """
+    def __init__( self,
+                  filename,
+                  cache_dir=None,
+                  buffer_size=100,
+                  reuse_event_object=False,
+                  compile_cache=True ):
+        """
+        filename
+
+        The name of a MIDI file, usually a .mid or .rtx MIDI file.
+
+        cache_dir=None
+
+        The directory to store the cache file. None stores the cache
+        file alongside the MIDI file, with .umc appended to the file name.
+        The directory is created if it does not exist.
+
+        buffer_size=100
+
+        The buffer size used by MidiFile if the cache has to be compiled.
+
+        reuse_event_object=False
+
+        True will reuse the event object during iteration, using less RAM.
+
+        compile_cache=True
+
+        False raises OSError if the cache file is missing or out of date,
+        instead of compiling it. Opening a compiled cache only reads
+        the cache header, which is fast.
+
+        An OSError is raised if the cache file can't be written, for
+        example if the file system is read only.
+        A ValueError is raised if the song is too long to be compiled.
+        """
+        self._filename = os_path_abspath( filename )
+        self._reuse_event_object = reuse_event_object
+
+        if cache_dir is None:
+            self._cache_filename = self._filename + _COMPILED_EXTENSION
+        else:
+            basename = self._filename.split("/")[-1]
+            self._cache_filename = cache_dir.rstrip("/") + "/" \
+                                   + basename + _COMPILED_EXTENSION
+
+        header = self._read_header()
+        if header is None:
+            if not compile_cache:
+                raise OSError( "Not compiled " + self._cache_filename )
+            if cache_dir is not None:
+                try:
+                    os.mkdir( cache_dir )
+                except OSError:
+                    # Directory already exists
+                    pass
+            MidiFile( self._filename,
+                      buffer_size=buffer_size,
+                      cursor_parser=True ).compile(
+                self._cache_filename )
+            header = self._read_header()
+            if header is None:
+                raise OSError( "Could not compile " + self._cache_filename )
+
+        self._record_count, self._length_us = header
+
+    def _read_header( self ):
+        # Returns (number of records, length in microseconds) if the
+        # cache file exists and is up to date with the MIDI file,
+        # otherwise returns None.
+        file_stat = os.stat( self._filename )
+        try:
+            with open( self._cache_filename, "rb" ) as file:
+                header = file.read( _COMPILED_HEADER_SIZE )
+        except OSError:
+            return None
+
+        if len(header) != _COMPILED_HEADER_SIZE \
+                or header[0:4] != _COMPILED_MAGIC \
+                or int.from_bytes( header[4:8], "little" ) \
+                    != file_stat[6] & 0xffffffff \
+                or int.from_bytes( header[8:12], "little" ) \
+                    != file_stat[8] & 0xffffffff:
+            return None
+
+        return int.from_bytes( header[12:16], "little" ), \
+               int.from_bytes( header[16:20], "little" )
+
+    @property
+    def filename( self ):
+        """
+        Return the file name of the MIDI file, with absolute path.
+        """
+        return self._filename
+
+    @property
+    def cache_filename( self ):
+        """
+        Return the file name of the compiled event cache.
+        """
+        return self._cache_filename
+
+    @property
+    def reuse_event_object( self ):
+        """
+        Return the value of reuse_event_object, see MidiFile.
+        """
+        return self._reuse_event_object
+
+    def length_us( self ):
+        """
+        Returns the length of the MIDI file in microseconds.
+        This is stored in the cache, no parsing is needed. The length
+        is at most 0xffffffff (about 71 minutes), see MidiFile.compile.
+        """
+        return self._length_us
 
+    def __iter__( self ):
+        """
+        Iterate through the events of the compiled MIDI file, for example:
+            for event in CompiledMidiFile("example.mid"):
+                print(event)
+        """
+        return self._compiled_events( self._reuse_event_object )
+
+    def seek( self, start_us ):
+        """
+        Returns an iterator through the events, starting at start_us
+        microseconds from the beginning of the file. The first events
+        returned restore the state of the channels at that
+        position, see MidiFile.seek. start_us is limited to
+        0xffffffff (about 71 minutes), the end of the longest cache.
+        """
+        return self._seek_events( min( start_us, _MAX_TIME_US ) )
+
+    def _seek_events( self, start_us ):
+        # Generator used by seek(). No checkpoints are needed, going
+        # through the records before the start position is fast.
+        reuse_event_object = self._reuse_event_object
+        chase = _ChaseState()
+        tempo = 500_000
+        event_time = 0
+        events = self._compiled_events( True )
+        for event in events:
+            event_time += event.delta_us
+            if event_time >= start_us \
+                    or event._status == END_OF_TRACK:
+                break
+            if event._status == SET_TEMPO:
+                tempo = event.tempo
+            else:
+                chase.update( event )
+
+        for chase_event in chase.events( tempo ):
+            chase_event.delta_us = 0
+            yield chase_event
+
+        # This event is the first at or after the start position
+        event.delta_us = max( event_time - start_us, 0 )
+        yield event if reuse_event_object else event.copy()
+        for event in events:
+            yield event if reuse_event_object else event.copy()
+
+    def _compiled_events( self, reuse_event_object ):
+        # Generator reading the cache records, and returning
+        # one MidiEvent per record.
+        event = MidiEvent()
+
+        # Preallocated buffers for the records and for the event data
+        buffer = bytearray( _COMPILED_RECORD_SIZE*32 )
+        data1 = memoryview( bytearray(1) )
+        data2 = memoryview( bytearray(2) )
+        data3 = memoryview( bytearray(3) )
+        sysex_buffer = bytearray( _INITIAL_EVENT_BUFFER_SIZE )
+
+        last_time = 0
+        position = 0
+        bytes_read = 0
+
+        with open( self._cache_filename, "rb" ) as file:
+            file.seek( _COMPILED_HEADER_SIZE )
+            while True:
+                if position >= bytes_read:
+                    bytes_read = file.readinto( buffer )
+                    position = 0
+                    if not bytes_read:
+                        return
+
+                # Most significant byte first, there are never more
+                # than two int objects alive when these are not small ints
+                event_time = ( ( ( ( buffer[position+3] << 8 )
+                                   | buffer[position+2] ) << 8
+                                 | buffer[position+1] ) << 8 ) \
+                             | buffer[position]
+                event_status = buffer[position+4]
+
+                if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+                    if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+                        data = data1
+                        data[0] = buffer[position+5]
+                    else:
+                        data = data2
+                        data[0] = buffer[position+5]
+                        data[1] = buffer[position+6]
+                    position += _COMPILED_RECORD_SIZE
+
+                elif event_status == SET_TEMPO:
+                    data = data3
+                    data[0] = buffer[position+5]
+                    data[1] = buffer[position+6]
+                    data[2] = buffer[position+7]
+                    position += _COMPILED_RECORD_SIZE
+
+                elif event_status in ( SYSEX, ESCAPE ):
+                    data_length = buffer[position+5] | ( buffer[position+6] << 8 )
+                    position += _COMPILED_RECORD_SIZE
+                    if data_length > len(sysex_buffer):
+                        sysex_buffer = bytearray( data_length )
+                    data = memoryview( sysex_buffer )[0:data_length]
+                    padded_length = data_length + ( -data_length % _COMPILED_RECORD_SIZE )
+
+                    # The data may continue past the end of the buffer
+                    available = min( bytes_read - position, padded_length )
+                    data[0:min(available, data_length)] = \
+                        buffer[position:position+min(available, data_length)]
+                    position += available
+                    if available < padded_length:
+                        if available < data_length:
+                            file.readinto( data[available:] )
+                        file.seek( padded_length - max( available, data_length ), 1 )
+
+                else:
+                    # END_OF_TRACK, always the last record
+                    data = b""
+                    position += _COMPILED_RECORD_SIZE
+
+                event._set( event_status, data, None )
+                event.delta_us = event_time - last_time
+                last_time = event_time
+
+                if reuse_event_object:
+                    yield event
+                else:
+                    yield event.copy()
+
+                if event_status == END_OF_TRACK:
+                    return
+
+    def play( self ):
+        """
+        Iterate through the events of the compiled MIDI file,
+        sleep until the event has to take place, and
+        yield the event. See MidiFile.play.
+        """
+        return _play_events( iter(self) )
+
+
+
+
+class MidiWriter:
+    """
+    Writes a standard MIDI file, format type 0 or 1, from MidiEvent
+    objects, using event.delta_miditicks as time. For example, to
+    write a copy of each track of a file:
+
+        midi_file = MidiFile("example.mid")
+        with MidiWriter("copy.mid", 1, midi_file.miditicks_per_quarter) as writer:
+            for track in midi_file.tracks:
+                writer.write_track( track )
+
+    Or, to merge all tracks into a format 0 file, write the events of
+    iterating through the MidiFile as a single track.
+
+    Running status is used for consecutive midi channel events with the
+    same event status byte. Meta and sysex events cancel running status,
+    as required by the MIDI file standard. A file written this way is
+    read back with the same events and times, and a file that was
+    written with running status and minimal length delta times is
+    written again byte by byte identical.
+
+    Events are written in chunks, the track lengths and the number of
+    tracks in the header are written when the track ends and
+    when the writer is closed, so the memory used is constant.
+    """
+    def __init__( self, filename, format_type=1, miditicks_per_quarter=96 ):
+        """
+        filename
+
+        The name of the MIDI file to write.
+
+        format_type=1
+
+        0 for a file with a single track, 1 for several tracks
+        to be played at the same time.
+
+        miditicks_per_quarter=96
+
+        The MIDI ticks per quarter note of the header, the
+        delta_miditicks of the events written are relative to this.
+        To copy a file with SMPTE time division, use the
+        MidiFile.division of the file.
+        """
+        if format_type not in ( 0, 1 ):
+            raise ValueError( "Only MIDI format type 0 and 1 files can be written" )
+        self._format_type = format_type
+        self._file = open( filename, "wb" )
+        self._file.write( b"MThd"
+                          + (6).to_bytes( 4, "big" )
+                          + format_type.to_bytes( 2, "big" )
+                          + (0).to_bytes( 2, "big" )
+                          + miditicks_per_quarter.to_bytes( 2, "big" ) )
+        self._tracks = 0
+        self._chunk = bytearray()
+        self._length_position = None
+        self._track_length = 0
+        self._running_status = None
+        self._track_ended = False
+
+    def start_track( self ):
+        """
+        Starts a new track, ending the current track if there is one.
+        A format type 0 file can only have one track, a second track
+        raises ValueError.
+        """
+        if self._length_position is not None:
+            self.end_track()
+        if self._format_type == 0 and self._tracks > 0:
+            raise ValueError( "A MIDI format type 0 file has only one track" )
+        self._file.write( b"MTrk\x00\x00\x00\x00" )
+        self._length_position = self._file.tell() - 4
+        self._track_length = 0
+        self._running_status = None
+        self._track_ended = False
+        self._tracks += 1
 
+    def write( self, event ):
+        """
+        Writes a MidiEvent to the current track, starting a track if
+        none was started. The time is event.delta_miditicks.
+        Writing an event after END_OF_TRACK raises ValueError.
+        """
+        if self._length_position is None:
+            self.start_track()
+        if self._track_ended:
+            raise ValueError( "Event after END_OF_TRACK" )
+
+        chunk = self._chunk
+        delta_miditicks = event.delta_miditicks
+        if delta_miditicks < 0x80:
+            chunk.append( delta_miditicks )
+        else:
+            chunk += _int_to_midi_number( delta_miditicks )
+
+        event_status = event._event_status_byte
+        data = event._data
+        if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+            if event_status != self._running_status:
+                chunk.append( event_status )
+                self._running_status = event_status
+        else:
+            if event_status == SYSEX or event_status == ESCAPE:
+                chunk.append( event_status )
+            else:
+                chunk.append( _META_PREFIX )
+                chunk.append( event_status )
+                if event_status == END_OF_TRACK:
+                    self._track_ended = True
+            if len( data ) < 0x80:
+                chunk.append( len( data ) )
+            else:
+                chunk += _int_to_midi_number( len( data ) )
+            self._running_status = None
+        chunk += data
+
+        if len( chunk ) >= _WRITER_CHUNK_SIZE:
+            self._file.write( chunk )
+            self._track_length += len( chunk )
+            self._chunk = bytearray()
+
+    def end_track( self ):
+        """
+        Ends the current track, writing a END_OF_TRACK event if the
+        last event written was not one.
+        """
+        if self._length_position is None:
+            return
+        if not self._track_ended:
+            self._chunk += b"\x00\xff\x2f\x00"
+        file = self._file
+        file.write( self._chunk )
+        self._track_length += len( self._chunk )
+        self._chunk = bytearray()
+
+        # Now go back and write the length of the track
+        end_position = file.tell()
+        file.seek( self._length_position )
+        file.write( self._track_length.to_bytes( 4, "big" ) )
+        file.seek( end_position )
+        self._length_position = None
+
+    def write_track( self, event_iterator ):
+        """
+        Writes all events of the event iterator as a new track.
+        The events can be a MidiTrack, a MidiFile (all tracks merged)
+        or any iterable of MidiEvent objects.
+        Returns the number of bytes of the track data.
+        """
+        self.start_track()
+        for event in event_iterator:
+            self.write( event )
+        self.end_track()
+        return self._track_length
+
+    def close( self ):
+        """
+        Ends the current track, writes the number of tracks in the
+        header and closes the file. A file with no tracks gets an
+        empty track.
+        """
+        if self._file is None:
+            return
+        if self._tracks == 0:
+            self.start_track()
+        self.end_track()
+        file = self._file
+        file.seek( 10 )
+        file.write( self._tracks.to_bytes( 2, "big" ) )
+        file.close()
+        self._file = None
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
+
+
+class EventDump:
+    """
+    Writes events to a log in a compact form, much faster and with
+    less memory allocation than printing the events. For example,
+    to log what the player sends:
+
+        with open("events.dump", "wb") as file:
+            dump = EventDump( file )
+            for event in MidiFile("example.mid", reuse_event_object=True):
+                dump.write( event )
+
+    The binary format has 8 byte records with the delta time in
+    microseconds, the event status byte and the data. Writing a
+    midi channel event does not allocate memory. EventDump.read()
+    reads the events back, to convert them to CSV on a PC.
+
+    The CSV format has a line per event with delta_us, the event
+    status byte in hex, the two data bytes of channel events,
+    and the data of other events in hex.
+    """
+    def __init__( self, stream, binary=True ):
+        """
+        stream
+
+        A file or stream opened for writing, in binary mode
+        for the binary format, or in text mode for CSV.
+
+        binary=True
+
+        True writes the binary format, False writes CSV. The CSV
+        header line is written now.
+        """
+        self._stream = stream
+        self._binary = binary
+        self._record = bytearray( _DUMP_RECORD_SIZE )
+        if not binary:
+            stream.write( _DUMP_CSV_HEADER )
+
+    @micropython.native
+    def write( self, event ):
+        """
+        Writes an event. The delta time is event.delta_us, written as
+        0 if it is None (events of a MidiTrack).
+        """
+        delta_us = event.delta_us
+        if delta_us is None:
+            delta_us = 0
+        event_status = event._event_status_byte
+        data = event._data
+        if not self._binary:
+            if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+                data2 = data[1] if len(data) > 1 else ""
+                self._stream.write( f"{delta_us},0x{event_status:02x},{data[0]},{data2},\n" )
+            else:
+                hex_data = "".join( f"{byte:02x}" for byte in data )
+                self._stream.write( f"{delta_us},0x{event_status:02x},,,{hex_data}\n" )
+            return
+
+        record = self._record
+        if delta_us > 0xffffffff:
+            delta_us = 0xffffffff
+        record[0] = delta_us & 0xff
+        record[1] = (delta_us >> 8) & 0xff
+        record[2] = (delta_us >> 16) & 0xff
+        record[3] = delta_us >> 24
+        record[4] = event_status
+        if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+            record[5] = data[0]
+            if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+                record[6] = 0
+            else:
+                record[6] = data[1]
+            record[7] = 0
+            self._stream.write( record )
+        else:
+            length = len(data)
+            if length > 255:
+                length = 255
+            record[5] = 0
+            record[6] = 0
+            record[7] = length
+            self._stream.write( record )
+            self._stream.write( data[0:length] )
+
+    @staticmethod
+    def read( stream ):
+        """
+        Generator to read the events of a binary dump from a stream
+        opened in binary mode. Returns a new MidiEvent for each event,
+        with delta_us set and delta_miditicks set to None.
+        """
+        while True:
+            record = stream.read( _DUMP_RECORD_SIZE )
+            if len(record) < _DUMP_RECORD_SIZE:
+                return
+            event_status = record[4]
+            if _FIRST_CHANNEL_EVENT <= event_status <= _LAST_CHANNEL_EVENT:
+                if _FIRST_1BYTE_EVENT <= event_status <= _LAST_1BYTE_EVENT:
+                    data = bytearray( record[5:6] )
+                else:
+                    data = bytearray( record[5:7] )
+            else:
+                data = bytearray( stream.read( record[7] ) )
+            event = MidiEvent()._set( event_status, data, None )
+            event.delta_us = int.from_bytes( record[0:4], "little" )
+            yield event
@@ -0,0 +1,234 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Allocation check for the playback loop of pedal/player.py, run on the
+# host with cPython:
+#   python3 tools/player_alloccheck.py
+# machine, utime and _thread are replaced by fakes, the UART records what
+# is written, and the play command is handled without the worker thread.
+# The song is played once from the compiled event cache and once parsing
+# the MIDI file, and tracemalloc measures the memory allocated between
+# two UART writes, events with the same time are sent with one write.
+#
+# cPython allocates an int object for values above 256, MicroPython stores
+# them as small ints (up to 2**30) without using the heap. Allocations up
+# to INT_ALLOWANCE bytes per event are accepted for that reason, a copied
+# event or a bytes object for the UART is always above it. The scheduler
+# keeps its times in an array, so this holds on cPython as well.
+# Refilling a file buffer also allocates, in cPython's buffered reader and
+# in the track parser, and so does a track of the MIDI file reaching its
+# end. The file reads and the track ends are counted, a write after one of
+# them may allocate more, at most once every REFILL_EVENTS events. Every
+# other write, in the steady state, may allocate nothing but the ints.
+# Measuring stops at the end of the song.
+
+import argparse
+import builtins
+import os
+import sys
+import tempfile
+import tracemalloc
+import types
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import umidibench
+from pedal import umidiparser
+
+# Two int objects alive at the same time, the allocator rounds up to 16 bytes.
+INT_ALLOWANCE = 2 * ((sys.getsizeof(2**29) + 15) // 16 * 16)
+
+# Events played before measuring, to let buffers and caches reach their size.
+WARMUP_EVENTS = 200
+
+# Fewest events read from one file buffer, the track parser buffer is 100 bytes.
+REFILL_EVENTS = 16
+
+# Reads of the files opened by the parser and tracks ended, an array so
+# that counting doesn't allocate
+file_events = array("L", [0])
+
+
+class CountedFile:
+    """Wraps a file opened by the parser, counts the reads that refill a buffer"""
+    def __init__(self, file):
+        self._file = file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def read(self, *args):
+        file_events[0] += 1
+        return self._file.read(*args)
+
+    def readinto(self, buffer):
+        file_events[0] += 1
+        return self._file.readinto(buffer)
+
+
+def counted_open(*args, **kwargs):
+    return CountedFile(builtins.open(*args, **kwargs))
+
+
+class FakeUART:
+    """Stands in for machine.UART, measures allocations between writes"""
+    def __init__(self, *args, **kwargs):
+        self.writes = 0
+        self.non_memoryview_writes = 0
+        self.max_allocated = 0
+        self.allocating_writes = 0
+        self.refill_writes = 0
+        self.last_file_events = 0
+        # Cleared at the end of the song
+        self.steady = True
+        self.bytes_written = 0
+        self.last_current = 0
+        # Keeps the data of the previous write alive, otherwise an object
+        # allocated per write would take the place of the previous one
+        # without raising the peak.
+        self.last_data = None
+
+    def write(self, data):
+        # Nothing may be allocated here before reading the peak
+        if self.steady and self.writes >= WARMUP_EVENTS:
+            allocated = tracemalloc.get_traced_memory()[1] - self.last_current
+            if allocated > INT_ALLOWANCE:
+                if file_events[0] != self.last_file_events:
+                    self.refill_writes += 1
+                else:
+                    self.allocating_writes += 1
+                    if allocated > self.max_allocated:
+                        self.max_allocated = allocated
+        self.last_file_events = file_events[0]
+        if not isinstance(data, memoryview):
+            self.non_memoryview_writes += 1
+        self.writes += 1
+        self.bytes_written += len(data)
+        self.last_data = data
+        tracemalloc.reset_peak()
+        self.last_current = tracemalloc.get_traced_memory()[0]
+
+
+class FakeClock:
+    """Stands in for the utime ticks functions, sleeping advances the clock"""
+    def __init__(self):
+        self.now = 0
+
+    def ticks_us(self):
+        return self.now
+
+    def sleep_us(self, us):
+        self.now += us
+
+
+def install_fakes():
+    """Install machine and utime modules before importing the player, returns the clock"""
+    machine = types.ModuleType("machine")
+    machine.UART = FakeUART
+    sys.modules["machine"] = machine
+    clock = FakeClock()
+    utime = types.ModuleType("utime")
+    utime.ticks_us = clock.ticks_us
+    utime.sleep_us = clock.sleep_us
+    utime.ticks_add = lambda ticks, delta: ticks + delta
+    utime.ticks_diff = lambda ticks1, ticks2: ticks1 - ticks2
+    sys.modules["utime"] = utime
+    return clock
+
+
+def check(player_module, clock, directory, filename, compiled):
+    from pedal import playlist
+
+    # Each song starts at 0, the times stay below 2**30 like the MicroPython ticks
+    clock.now = 0
+    umidiparser.open = counted_open
+
+    if compiled:
+        cache_dir = os.path.join(directory, "cache")
+    else:
+        # A file in place of the cache directory, the player falls back to MidiFile
+        cache_dir = os.path.join(directory, "nocache")
+        open(cache_dir, "w").close()
+    # The interface polls the player status, it isn't called by the player
+    player = player_module.Player(playlist.Playlist(path=directory), None, cache_dir=cache_dir)
+
+    # The worker thread isn't started, the commands are handled in this
+    # thread with Player.step(), the measurement needs to see its allocations
+    fake_thread = types.SimpleNamespace(start_new_thread=lambda function, args: None,
+                                        exit=sys.exit)
+    player_module._thread = fake_thread
+
+    heappop = umidiparser._heappop
+
+    def counted_heappop(heap):
+        # Called by the track merger when a track ends
+        file_events[0] += 1
+        return heappop(heap)
+
+    uart = player.midi_out
+    scheduler = player.scheduler
+    finish = scheduler.finish
+
+    def finish_song():
+        uart.steady = False
+        finish()
+
+    umidiparser._heappop = counted_heappop
+    scheduler.finish = finish_song
+    player.play()
+    tracemalloc.start()
+    player.step()
+    tracemalloc.stop()
+    del umidiparser.open
+    umidiparser._heappop = heappop
+
+    mode = "compiled cache" if compiled else "MIDI file"
+    print("{:>14}: {} writes, {} bytes, {} writes refilled a buffer, "
+          "{} writes allocated, {} bytes at most".format(
+              mode, uart.writes, uart.bytes_written, uart.refill_writes,
+              uart.allocating_writes, uart.max_allocated))
+    ok = True
+    if uart.non_memoryview_writes:
+        print("    FAIL: {} UART writes were not a memoryview".format(uart.non_memoryview_writes))
+        ok = False
+    events = sum(1 for _ in umidiparser.MidiFile(filename, reuse_event_object=True))
+    if uart.allocating_writes:
+        print("    FAIL: more than {} bytes allocated in the steady state".format(
+            INT_ALLOWANCE))
+        ok = False
+    if uart.refill_writes > events // REFILL_EVENTS + 1:
+        print("    FAIL: a file was read more than once every {} events".format(REFILL_EVENTS))
+        ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Allocation check for the player loop")
+    parser.add_argument("-e", "--events", type=int, default=5000,
+                        help="number of events per track")
+    parser.add_argument("-t", "--tracks", type=int, default=4,
+                        help="number of tracks")
+    args = parser.parse_args()
+
+    clock = install_fakes()
+    from pedal import player as player_module
+
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "cache"))
+        filename = os.path.join(directory, "song.mid")
+        umidibench.make_midi_file(filename, args.tracks, args.events)
+        for compiled in (True, False):
+            ok = check(player_module, clock, directory, filename, compiled) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Checks that no note is left sounding when a song is stopped, run on
+# the host with cPython:
+#   python3 tools/player_paniccheck.py
+# machine and utime are replaced by the fakes of player_alloccheck.py.
+# The song is stopped after each of the first events in turn, the
+# stop command arrives while the events of a chord are queued. What was
+# written to the UART is decoded as a MIDI receiver would, with running
+# status, and after the stop no note may be held and no sustain pedal down.
+# The same is checked when playing fails with an error instead of a stop,
+# the worker loop must stop the notes and carry on with the next command.
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import player_alloccheck
+import umidibench
+
+
+class MidiReceiver:
+    """Decodes a MIDI byte stream, keeps the notes held and the sustain pedals"""
+    def __init__(self):
+        self.held = set()
+        self.sustain = set()
+        self.running_status = None
+        self.message = []
+        self.errors = 0
+
+    def receive(self, data):
+        for byte in data:
+            if byte >= 0xf8:
+                continue
+            if byte >= 0x80:
+                self.running_status = byte if byte < 0xf0 else None
+                self.message = []
+                continue
+            if self.running_status is None:
+                # A data byte without a status byte
+                self.errors += 1
+                continue
+            self.message.append(byte)
+            event_type = self.running_status & 0xf0
+            length = 1 if event_type in (0xc0, 0xd0) else 2
+            if len(self.message) == length:
+                self.apply(self.running_status, self.message)
+                self.message = []
+
+    def apply(self, status, data):
+        channel = status & 0x0f
+        event_type = status & 0xf0
+        if event_type == 0x90 and data[1]:
+            self.held.add((channel, data[0]))
+        elif event_type in (0x80, 0x90):
+            self.held.discard((channel, data[0]))
+        elif event_type == 0xb0:
+            if data[0] in (120, 123):
+                self.held = {note for note in self.held if note[0] != channel}
+            elif data[0] == 64:
+                if data[1] >= 64:
+                    self.sustain.add(channel)
+                else:
+                    self.sustain.discard(channel)
+
+
+def check(player_module, directory, stop_after_events, note_off_as_note_on, error=False):
+    from pedal import playlist
+
+    player = player_module.Player(playlist.Playlist(path=directory), None,
+                                  cache_dir=os.path.join(directory, "cache"),
+                                  note_off_as_note_on=note_off_as_note_on)
+    receiver = MidiReceiver()
+    uart = player.midi_out
+    write = uart.write
+
+    def receive(data):
+        receiver.receive(bytes(data))
+        write(data)
+
+    uart.write = receive
+    scheduler = player.scheduler
+    send = scheduler.send
+    sent = [0]
+
+    def send_and_stop(event):
+        send(event)
+        sent[0] += 1
+        if sent[0] == stop_after_events:
+            if error:
+                # Handled by the worker loop, which then quits
+                player.quit()
+                raise RuntimeError("error after {} events".format(sent[0]))
+            # The player sees it before the next event, events at
+            # the same time as this one are still queued
+            player.stop()
+
+    scheduler.send = send_and_stop
+    player.play()
+    if error:
+        try:
+            # The error message goes to the console
+            with contextlib.redirect_stdout(io.StringIO()):
+                player._worker()
+        except SystemExit:
+            pass
+    else:
+        while player.mailbox.pending():
+            player.step()
+    what = "error" if error else "stop"
+    if receiver.errors or receiver.held or receiver.sustain:
+        print("{} after {} events: {} notes held, {} sustain pedals down, "
+              "{} data bytes without status".format(
+                  what, stop_after_events, len(receiver.held), len(receiver.sustain),
+                  receiver.errors))
+        return False
+    if player.is_playing:
+        print("{} after {} events: still playing".format(what, stop_after_events))
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stuck note check for the player")
+    parser.add_argument("-r", "--runs", type=int, default=200,
+                        help="number of stop positions")
+    args = parser.parse_args()
+
+    player_alloccheck.install_fakes()
+    from pedal import player as player_module
+    player_module._thread = types.SimpleNamespace(start_new_thread=lambda function, args: None,
+                                                  exit=sys.exit)
+    # The song statistics are printed at each stop
+    player_module.Player.report_output = lambda self: None
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "cache"))
+        umidibench.make_midi_file(os.path.join(directory, "song.mid"), 4, 1000)
+        for note_off_as_note_on, error in ((False, False), (True, False), (False, True)):
+            for stop_after_events in range(1, args.runs + 1):
+                if not check(player_module, directory, stop_after_events,
+                             note_off_as_note_on, error):
+                    failures += 1
+    print("{} of {} stops left notes sounding".format(failures, 3 * args.runs))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
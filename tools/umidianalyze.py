@@ -0,0 +1,214 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Checks a library of MIDI files before copying them to the SD card,
+# run on the host with cPython:
+#   python3 tools/umidianalyze.py library/ -f csv -o report.csv
+# Files are parsed with umidiparser in a pool of processes, one per core
+# by default. Each result is written as soon as it's ready, as a line of
+# JSON (one object per file) or a CSV row, in the order the files finish.
+# For each file: length, event counts, the most events in a millisecond,
+# the peak bytes per second in a sliding window against the 3125 bytes
+# per second of a 31250 baud UART, the tempo changes, and the parse error
+# if the file can't be played. The UART is simulated as in
+# pedal/bandwidth.py to find the worst lateness, the windows of events
+# later than 5 ms and the UART buffer overflows.
+# With --late-list the names of the files that will play late, or can't
+# be played, are also written one per line, copy that file to the SD
+# card as late.txt so the player marks those songs with "!":
+#   python3 tools/umidianalyze.py library/ -o report.json -l library/late.txt
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pedal import umidiparser
+from pedal.bandwidth import UartSimulation
+
+# 31250 baud, 10 bits per byte
+UART_BYTES_PER_SECOND = 3125
+
+FIELDS = ("filename", "length_s", "events", "channel_events", "notes",
+          "control_changes", "sysex", "meta", "tempo_changes",
+          "max_events_per_ms", "peak_bytes_per_s", "peak_uart_percent",
+          "max_lateness_ms", "late_windows", "uart_overflows", "error")
+
+
+def analyze(filename, window_ms=100):
+    """
+    Returns a dictionary with FIELDS for the MIDI file.
+    """
+    result = dict.fromkeys(FIELDS, 0)
+    result["filename"] = filename
+    result["error"] = ""
+    try:
+        with umidiparser.MidiFile(filename, reuse_event_object=True, use_mmap=True) as midi_file:
+            analyze_events(midi_file, result, window_ms)
+    except Exception as error:
+        # The file can't be played, report why and continue with the next one
+        result["error"] = "{}: {}".format(type(error).__name__, error)
+    return result
+
+
+def analyze_events(midi_file, result, window_ms):
+    time_us = 0
+    events = channel_events = notes = control_changes = sysex = meta = tempo_changes = 0
+
+    # Events in the current millisecond
+    current_ms = 0
+    events_in_ms = 0
+    max_events_per_ms = 0
+
+    # Bytes sent in each millisecond of the sliding window, as a ring
+    window_bytes = [0] * window_ms
+    window_total = 0
+    window_end_ms = 0
+    peak_window_bytes = 0
+
+    uart = UartSimulation()
+
+    for event in midi_file:
+        time_us += event.delta_us
+        event_ms = time_us // 1000
+        events += 1
+
+        if event_ms != current_ms:
+            current_ms = event_ms
+            events_in_ms = 0
+        events_in_ms += 1
+        if events_in_ms > max_events_per_ms:
+            max_events_per_ms = events_in_ms
+
+        if event.is_meta():
+            meta += 1
+            if event.is_tempo():
+                tempo_changes += 1
+            continue
+
+        status = event.status
+        if status in (umidiparser.SYSEX, umidiparser.ESCAPE):
+            sysex += 1
+        else:
+            channel_events += 1
+            if status in (umidiparser.NOTE_ON, umidiparser.NOTE_OFF):
+                notes += 1
+            elif status == umidiparser.CONTROL_CHANGE:
+                control_changes += 1
+
+        # Move the window to end at this millisecond, the milliseconds
+        # leaving the window are cleared
+        if event_ms - window_end_ms >= window_ms:
+            window_bytes = [0] * window_ms
+            window_total = 0
+        else:
+            while window_end_ms < event_ms:
+                window_end_ms += 1
+                slot = window_end_ms % window_ms
+                window_total -= window_bytes[slot]
+                window_bytes[slot] = 0
+        window_end_ms = event_ms
+        size = len(event.to_midi())
+        uart.send(time_us, size)
+        window_bytes[event_ms % window_ms] += size
+        window_total += size
+        if window_total > peak_window_bytes:
+            peak_window_bytes = window_total
+
+    uart.finish()
+    peak_bytes_per_s = peak_window_bytes * 1000 // window_ms
+    result.update({
+        "length_s": round(time_us / 1000000, 3),
+        "events": events,
+        "channel_events": channel_events,
+        "notes": notes,
+        "control_changes": control_changes,
+        "sysex": sysex,
+        "meta": meta,
+        # The first set tempo sets the tempo, it isn't a change
+        "tempo_changes": max(tempo_changes - 1, 0),
+        "max_events_per_ms": max_events_per_ms,
+        "peak_bytes_per_s": peak_bytes_per_s,
+        "peak_uart_percent": round(peak_bytes_per_s * 100 / UART_BYTES_PER_SECOND, 1),
+        "max_lateness_ms": round(uart.max_lateness_us / 1000, 1),
+        "late_windows": uart.window_count,
+        "uart_overflows": uart.overflows,
+    })
+
+
+def midi_files(paths):
+    """Yield the MIDI files given, and those in the directories given"""
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith((".mid", ".midi")):
+                        yield os.path.join(directory, filename)
+        else:
+            yield path
+
+
+class _Analyzer:
+    # Picklable function for the pool, with the window size
+    def __init__(self, window_ms):
+        self.window_ms = window_ms
+
+    def __call__(self, filename):
+        return analyze(filename, self.window_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a library of MIDI files")
+    parser.add_argument("paths", nargs="+", help="MIDI files or directories")
+    parser.add_argument("-f", "--format", default="json",
+                        help="json (one object per line) or csv, default json")
+    parser.add_argument("-o", "--output", help="report file, default standard output")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes, default one per core")
+    parser.add_argument("-w", "--window-ms", type=int, default=100,
+                        help="window for the peak bandwidth, in milliseconds")
+    parser.add_argument("-l", "--late-list",
+                        help="file for the names of the files that will play late")
+    args = parser.parse_args()
+    if args.format not in ("json", "csv"):
+        parser.error("unknown format " + args.format)
+    if args.window_ms < 1:
+        parser.error("the window must be at least 1 ms")
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "csv":
+            writer = csv.DictWriter(output, FIELDS)
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            def write(result):
+                output.write(json.dumps(result) + "\n")
+
+        errors = 0
+        late = []
+        with multiprocessing.Pool(args.jobs) as pool:
+            for result in pool.imap_unordered(_Analyzer(args.window_ms),
+                                              midi_files(args.paths), chunksize=4):
+                write(result)
+                output.flush()
+                if result["error"]:
+                    errors += 1
+                if result["error"] or result["late_windows"] or result["uart_overflows"]:
+                    late.append(os.path.basename(result["filename"]))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if args.late_list:
+        with open(args.late_list, "w") as late_list:
+            for filename in sorted(late):
+                late_list.write(filename + "\n")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
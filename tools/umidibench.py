@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmarks for pedal/umidiparser.py, run on the host with cPython:
+#   python3 tools/umidibench.py merge parse write
+# The MIDI files used are generated with random events in a temporary
+# directory, so results are repeatable.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pedal import umidiparser
+
+
+def midi_number(value):
+    """Encode value as MIDI variable length number"""
+    data = [value & 0x7f]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7f))
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def make_track(rng, events, channel, tempo=False):
+    """Return a MTrk chunk with random note and controller events, using running status"""
+    data = bytearray()
+    if tempo:
+        data += b"\x00\xff\x51\x03" + (500000).to_bytes(3, "big")
+    running_status = None
+    for _ in range(events):
+        data += midi_number(rng.choice((0, 0, 0, 6, 12, 24, 48, 96)))
+        status = rng.choice((0x90, 0x90, 0x80, 0xb0, 0xe0)) | channel
+        if status != running_status:
+            data.append(status)
+            running_status = status
+        data += bytes((rng.randint(0, 127), rng.randint(0, 127)))
+    data += b"\x00\xff\x2f\x00"
+    return b"MTrk" + len(data).to_bytes(4, "big") + bytes(data)
+
+
+def make_midi_file(filename, tracks, events_per_track, seed=1):
+    """Write a format 1 (or format 0 for one track) file with random events"""
+    rng = random.Random(seed)
+    with open(filename, "wb") as file:
+        file.write(b"MThd" + (6).to_bytes(4, "big")
+                   + (0 if tracks == 1 else 1).to_bytes(2, "big")
+                   + tracks.to_bytes(2, "big")
+                   + (96).to_bytes(2, "big"))
+        for track in range(tracks):
+            file.write(make_track(rng, events_per_track, track % 16, tempo=(track == 0)))
+
+
+def timed(function, repeat=3):
+    """Return best time of several runs, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def linear_track_merger(midi_file):
+    """The track merger before the heap was introduced: min() over all tracks per event"""
+    play_tracks = [track._track_parse_start() for track in midi_file.tracks]
+    current_miditicks = 0
+    while True:
+        next_track = min(play_tracks)
+        event = next_track.event
+        track_miditicks = next_track.current_miditicks
+        event.delta_miditicks = track_miditicks - current_miditicks
+        if event.status == umidiparser.END_OF_TRACK:
+            del play_tracks[play_tracks.index(next_track)]
+            if len(play_tracks) == 0:
+                yield event
+                return
+            continue
+        yield event
+        current_miditicks = track_miditicks
+        next_track._track_parse_next()
+
+
+def bench_merge(directory, total_events):
+    print("Track merge, {} events per file".format(total_events))
+    print("{:>7} {:>12} {:>12} {:>8}".format("tracks", "linear us/ev", "heap us/ev", "speedup"))
+    for tracks in (2, 4, 8, 12, 16, 24, 32, 48):
+        filename = os.path.join(directory, "merge{}.mid".format(tracks))
+        make_midi_file(filename, tracks, total_events // tracks)
+        midi_file = umidiparser.MidiFile(filename, buffer_size=0, reuse_event_object=True)
+
+        def linear():
+            for _ in linear_track_merger(midi_file):
+                pass
+
+        def heap():
+            for _ in midi_file._track_merger():
+                pass
+
+        linear_time = timed(linear)
+        heap_time = timed(heap)
+        print("{:>7} {:>12.3f} {:>12.3f} {:>8.2f}".format(
+            tracks,
+            linear_time * 1e6 / total_events,
+            heap_time * 1e6 / total_events,
+            linear_time / heap_time))
+
+
+def bench_parse(directory, total_events):
+    print("Track parsing, {} events, generator versus cursor parser".format(total_events))
+    print("{:>11} {:>15} {:>12} {:>8}".format("buffer_size", "generator us/ev", "cursor us/ev", "speedup"))
+    filename = os.path.join(directory, "parse.mid")
+    make_midi_file(filename, 1, total_events)
+    for buffer_size in (0, 100, 512):
+
+        def parse(cursor_parser):
+            # Time the parser alone, without the tempo processing of MidiFile.__iter__
+            midi_file = umidiparser.MidiFile(filename,
+                                             buffer_size=buffer_size,
+                                             cursor_parser=cursor_parser)
+            for _ in midi_file.tracks[0]._get_event_parser():
+                pass
+
+        generator_time = timed(lambda: parse(False))
+        cursor_time = timed(lambda: parse(True))
+        print("{:>11} {:>15.3f} {:>12.3f} {:>8.2f}".format(
+            buffer_size,
+            generator_time * 1e6 / total_events,
+            cursor_time * 1e6 / total_events,
+            generator_time / cursor_time))
+
+
+def bench_write(directory, total_events):
+    # total_events is ignored, the file is about 1 MB
+    tracks = 16
+    filename = os.path.join(directory, "write.mid")
+    make_midi_file(filename, tracks, 1000000 // 3 // tracks)
+    size = os.path.getsize(filename)
+    output_filename = os.path.join(directory, "written.mid")
+    midi_file = umidiparser.MidiFile(filename)
+    events = [list(track) for track in midi_file.tracks]
+    print("MidiWriter, {} bytes, {} events in {} tracks".format(
+        size, sum(len(track) for track in events), tracks))
+
+    def write():
+        with umidiparser.MidiWriter(output_filename, 1, midi_file.division) as writer:
+            for track in events:
+                writer.write_track(track)
+
+    def rewrite():
+        source = umidiparser.MidiFile(filename, buffer_size=0, reuse_event_object=True)
+        with umidiparser.MidiWriter(output_filename, 1, source.division) as writer:
+            for track in source.tracks:
+                writer.write_track(track)
+
+    write_time = timed(write)
+    rewrite_time = timed(rewrite)
+    identical = open(filename, "rb").read() == open(output_filename, "rb").read()
+    print("{:>22} {:>8} {:>8}".format("", "seconds", "MB/s"))
+    print("{:>22} {:>8.3f} {:>8.1f}".format("write only", write_time, size / write_time / 1e6))
+    print("{:>22} {:>8.3f} {:>8.1f}".format("parse and write", rewrite_time, size / rewrite_time / 1e6))
+    print("Output identical to input: {}".format(identical))
+
+
+def bench_access(directory, total_events):
+    print("Event access, {} events, properties versus unpack() and kind".format(total_events))
+    filename = os.path.join(directory, "access.mid")
+    make_midi_file(filename, 1, total_events)
+    events = list(umidiparser.MidiFile(filename))
+
+    def loop():
+        # Cost of the loop alone, subtracted from the others
+        for event in events:
+            pass
+
+    def properties():
+        for event in events:
+            if event.is_meta():
+                continue
+            status = event.status
+            if status == umidiparser.NOTE_ON or status == umidiparser.NOTE_OFF:
+                event.channel, event.note, event.velocity, event.delta_us
+            elif status == umidiparser.CONTROL_CHANGE:
+                event.channel, event.control, event.value, event.delta_us
+
+    def unpack():
+        for event in events:
+            if event.kind != umidiparser.KIND_CHANNEL:
+                continue
+            status, data1, data2, delta_us = event.unpack()
+            status & 0x0f
+
+    loop_time = timed(loop)
+    properties_time = timed(properties) - loop_time
+    unpack_time = timed(unpack) - loop_time
+    print("{:>16} {:>12} {:>8}".format("properties us/ev", "unpack us/ev", "speedup"))
+    print("{:>16.3f} {:>12.3f} {:>8.2f}".format(
+        properties_time * 1e6 / len(events),
+        unpack_time * 1e6 / len(events),
+        properties_time / unpack_time))
+
+
+BENCHMARKS = {
+    "access": bench_access,
+    "merge": bench_merge,
+    "parse": bench_parse,
+    "write": bench_write,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for umidiparser")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="benchmarks to run: {}, default all".format(", ".join(sorted(BENCHMARKS))))
+    parser.add_argument("-e", "--events", type=int, default=20000,
+                        help="number of events per test file")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.benchmarks or sorted(BENCHMARKS):
+            BENCHMARKS[name](directory, args.events)
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Converts event dumps written by umidiparser.EventDump to CSV, or dumps
+# the events of MIDI files as CSV, run on the host with cPython:
+#   python3 tools/umididump.py events.dump > events.csv
+#   python3 tools/umididump.py song.mid -o song.csv
+# Files ending in .mid or .midi are parsed as MIDI files, with the
+# delta times in microseconds, other files are read as binary dumps.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pedal import umidiparser
+
+
+def dump(filename, output):
+    """Write the events of a MIDI file or binary dump as CSV to output"""
+    csv_dump = umidiparser.EventDump(output, binary=False)
+    if filename.lower().endswith((".mid", ".midi")):
+        for event in umidiparser.MidiFile(filename, reuse_event_object=True):
+            csv_dump.write(event)
+    else:
+        with open(filename, "rb") as file:
+            for event in umidiparser.EventDump.read(file):
+                csv_dump.write(event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert event dumps and MIDI files to CSV")
+    parser.add_argument("files", nargs="+", help="binary event dumps or MIDI files")
+    parser.add_argument("-o", "--output", help="CSV file, default standard output")
+    args = parser.parse_args()
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for filename in args.files:
+            dump(filename, output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
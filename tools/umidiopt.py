@@ -0,0 +1,175 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Rewrites MIDI files for playback on the pedal, run on the host with cPython:
+#   python3 tools/umidiopt.py song.mid -o optimized/song.mid
+#   python3 tools/umidiopt.py *.mid -o optimized
+# The optimized file has:
+#   - the meta events that don't affect playback removed (text, lyrics,
+#     copyright, track names, sequencer specific...). Tempo, time signature,
+#     key signature and SMPTE offset are kept.
+#   - all tracks merged into one, format 0, so there is no track merge
+#     and only one file buffer during playback.
+#   - control changes that repeat the current value of the controller removed.
+#   - running status, written by umidiparser.MidiWriter.
+# The parse time with umidiparser is reported before and after.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import umidibench
+from pedal import umidiparser
+
+# Meta events needed to play or seek
+PLAYABLE_META = (umidiparser.SET_TEMPO,
+                 umidiparser.END_OF_TRACK,
+                 umidiparser.TIME_SIGNATURE,
+                 umidiparser.KEY_SIGNATURE,
+                 umidiparser.SMPTE_OFFSET)
+
+# Control changes that are not a controller value: data entry and
+# RPN/NRPN, which depend on the parameter selected, and channel mode
+# messages. These are never removed.
+NOT_REDUNDANT_CONTROLLERS = (6, 38, 96, 97, 98, 99, 100, 101,
+                             120, 121, 122, 123, 124, 125, 126, 127)
+RESET_ALL_CONTROLLERS = 121
+
+UNKNOWN = 0xff
+
+
+class Statistics:
+    """Counts of what was removed"""
+    def __init__(self):
+        self.events = 0
+        self.meta_removed = 0
+        self.controllers_removed = 0
+
+
+def optimize_events(events, statistics, keep_meta=False, keep_redundant=False):
+    """
+    Yield the events to keep, with delta_miditicks adjusted
+    for the time of the events removed.
+    """
+    # Current value of each controller of each channel
+    controllers = bytearray([UNKNOWN] * (16 * 128))
+    skipped_miditicks = 0
+    for event in events:
+        statistics.events += 1
+        status = event.status
+        remove = False
+        if event.is_meta():
+            remove = not keep_meta and status not in PLAYABLE_META
+            if remove:
+                statistics.meta_removed += 1
+        elif status == umidiparser.CONTROL_CHANGE:
+            control = event.control
+            slot = event.channel * 128 + control
+            if control == RESET_ALL_CONTROLLERS:
+                for index in range(event.channel * 128, event.channel * 128 + 128):
+                    controllers[index] = UNKNOWN
+            elif control not in NOT_REDUNDANT_CONTROLLERS:
+                if not keep_redundant and controllers[slot] == event.value:
+                    remove = True
+                    statistics.controllers_removed += 1
+                controllers[slot] = event.value
+        elif status in (umidiparser.SYSEX, umidiparser.ESCAPE):
+            # May reset the controllers, such as GM System On
+            for index in range(len(controllers)):
+                controllers[index] = UNKNOWN
+
+        if remove:
+            skipped_miditicks += event.delta_miditicks
+            continue
+        event.delta_miditicks += skipped_miditicks
+        skipped_miditicks = 0
+        yield event
+
+
+def optimize(filename, output_filename, merge=True, keep_meta=False, keep_redundant=False):
+    """
+    Write the optimized MIDI file, returns the Statistics.
+    """
+    midi_file = umidiparser.MidiFile(filename)
+    statistics = Statistics()
+    tracks = midi_file.tracks
+    if merge and midi_file.format_type == 2 and len(tracks) > 1:
+        # The tracks of a format 2 file are separate songs
+        merge = False
+    if not merge and midi_file.format_type == 1 and len(tracks) > 1 and not keep_redundant:
+        # Another track may change the controller between repeated values
+        print("{}: tracks not merged, repeated control changes are kept".format(filename))
+        keep_redundant = True
+
+    if merge and len(tracks) > 1:
+        streams = [midi_file._track_merger()]
+        format_type = 0
+    else:
+        streams = [iter(track) for track in tracks]
+        format_type = midi_file.format_type
+
+    with umidiparser.MidiWriter(output_filename, format_type,
+                                midi_file.division) as writer:
+        for events in streams:
+            writer.write_track(optimize_events(events, statistics,
+                                               keep_meta=keep_meta,
+                                               keep_redundant=keep_redundant))
+    return statistics
+
+
+def parse_time(filename):
+    """Best time to parse all events of the file, in seconds"""
+    def parse():
+        for _ in umidiparser.MidiFile(filename, reuse_event_object=True):
+            pass
+    return umidibench.timed(parse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimize MIDI files for the pedal")
+    parser.add_argument("files", nargs="+", help="MIDI files to optimize")
+    parser.add_argument("-o", "--output", required=True,
+                        help="output file, or output directory for several files")
+    parser.add_argument("--no-merge", action="store_true",
+                        help="keep the tracks, don't merge them into one")
+    parser.add_argument("--keep-meta", action="store_true",
+                        help="keep all meta events")
+    parser.add_argument("--keep-redundant", action="store_true",
+                        help="keep control changes repeating the current value")
+    args = parser.parse_args()
+
+    if len(args.files) > 1 or os.path.isdir(args.output):
+        if not os.path.isdir(args.output):
+            parser.error("the output must be a directory for several files")
+        outputs = [os.path.join(args.output, os.path.basename(filename)) for filename in args.files]
+    else:
+        outputs = [args.output]
+
+    print("{:<30} {:>9} {:>9} {:>6} {:>6} {:>10} {:>10}".format(
+        "file", "bytes", "optimized", "meta", "CC", "parse ms", "optimized"))
+    for filename, output_filename in zip(args.files, outputs):
+        if os.path.abspath(filename) == os.path.abspath(output_filename):
+            print("{}: output is the input file, skipped".format(filename))
+            continue
+        try:
+            statistics = optimize(filename, output_filename,
+                                  merge=not args.no_merge,
+                                  keep_meta=args.keep_meta,
+                                  keep_redundant=args.keep_redundant)
+        except (OSError, ValueError, RuntimeError) as error:
+            print("{}: {}".format(filename, error))
+            continue
+        print("{:<30} {:>9} {:>9} {:>6} {:>6} {:>10.2f} {:>10.2f}".format(
+            os.path.basename(filename)[:30],
+            os.path.getsize(filename),
+            os.path.getsize(output_filename),
+            statistics.meta_removed,
+            statistics.controllers_removed,
+            parse_time(filename) * 1000,
+            parse_time(output_filename) * 1000))
+
+
+if __name__ == "__main__":
+    main()